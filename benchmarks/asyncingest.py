@@ -0,0 +1,58 @@
+'''
+Shows reads overlapping construction in src.asyncbuilder.
+
+Every read of a standard library module is delayed by --latency seconds, a
+stand-in for network or cold storage. The files are built once with a window
+of 1, which reads and builds strictly in turn, then with --window reads in
+flight. A run without the added latency is the best the window can do.
+Run from the top of the repository:
+
+    python -m benchmarks.asyncingest --latency 0.005 --window 32
+'''
+
+from src.asyncbuilder import build_files_pipelined
+from src.batchbuilder import collect_source_files, read_source
+from functools import partial
+import argparse
+import sysconfig
+import time
+import sys
+import os
+
+def delayed_read(latency, file_path):
+    time.sleep(latency)
+    return read_source(file_path)
+
+def run(files, window, latency):
+    start = time.perf_counter()
+    results = build_files_pipelined(files, window,
+                                    read=partial(delayed_read, latency))
+    return results, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds added to every read (default 0.005)')
+    parser.add_argument('--window', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=500,
+                        help='number of modules to build (default 500)')
+    args = parser.parse_args(argv)
+
+    stdlib = sysconfig.get_paths()['stdlib']
+    skip = os.sep + 'site-packages' + os.sep
+    files = [f for f in collect_source_files(stdlib)
+             if skip not in f][:args.limit]
+    local, local_time = run(files, args.window, 0)
+    serial, serial_time = run(files, 1, args.latency)
+    pipelined, pipelined_time = run(files, args.window, args.latency)
+    assert [r.path for r in serial] == [r.path for r in pipelined]
+    print('%d files, %.1fms latency per read' % (len(files),
+                                                 args.latency * 1000))
+    print('    window 1   %.2fs' % serial_time)
+    print('    window %-3d %.2fs  (%.1fx)' % (args.window, pipelined_time,
+                                            serial_time / pipelined_time))
+    print('    no latency %.2fs' % local_time)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+'''
+Benchmarks for control flow graph construction and printing.
+
+Run from the top of the repository:
+
+    python -m benchmarks.runbenchmarks
+    python -m benchmarks.runbenchmarks --workload synthetic --mode statements
+    python -m benchmarks.runbenchmarks --update-baseline
+
+Workloads:
+    stdlib        every module of the local CPython standard library
+    synthetic     many generated functions (elif ladders, try bodies, loops)
+    pathological  a few generated functions at the limits of the builder
+
+Each workload runs in a fresh process so peak RSS is its own. Throughput is
+the best of --repeat runs. allocated_blocks is the number of memory blocks
+still allocated while the built graphs are alive, which tracks how much the
+graphs cost to keep.
+
+Results are compared with benchmarks/baseline.json, and the change in each
+metric from the baseline is printed under the result. A metric that is worse
+than the baseline by more than --tolerance makes the run exit with status 1,
+as does a baseline whose metrics are not the ones the run records. Baselines
+are machine specific; record one with --update-baseline.
+Nothing here needs network access.
+'''
+
+from src.controlflowgraph import ControlFlowGraph, StatementCFG, PrintCFG
+from src.compactgraph import number_blocks
+from src.batchbuilder import collect_source_files
+from benchmarks import synthetic
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import contextlib
+import argparse
+import sysconfig
+import resource
+import json
+import time
+import ast
+import sys
+import os
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baseline.json')
+WORKLOADS = ('stdlib', 'synthetic', 'pathological')
+MODES = {'full': ControlFlowGraph, 'statements': StatementCFG,
+         'compressed': partial(ControlFlowGraph, compress_exceptions=True),
+         'simplified': partial(ControlFlowGraph, simplify=True)}
+# Metric -> True when bigger is better
+METRICS = {'files_per_sec': True, 'blocks_per_sec': True,
+           'peak_rss_kb': False, 'allocated_blocks': False}
+
+def stdlib_sources(limit=None):
+    stdlib = sysconfig.get_paths()['stdlib']
+    skip = os.sep + 'site-packages' + os.sep
+    files = [f for f in collect_source_files(stdlib) if skip not in f]
+    sources = []
+    for file_path in files[:limit]:
+        with open(file_path, 'rb') as f:
+            sources.append((file_path, f.read()))
+    return sources
+
+def workload_sources(workload, limit=None):
+    if workload == 'stdlib':
+        return stdlib_sources(limit)
+    if workload == 'synthetic':
+        return synthetic.synthetic_sources()[:limit]
+    return synthetic.pathological_sources()[:limit]
+
+def parse_all(sources):
+    ''' Returns the trees and the number of sources which did not parse. '''
+    trees = []
+    failed = 0
+    for name, source in sources:
+        try:
+            trees.append(ast.parse(source, filename=name))
+        except (SyntaxError, ValueError):
+            failed += 1
+    return trees, failed
+
+def build_all(cfg_class, trees):
+    ''' Returns the trees which were built, the seconds spent building and
+        the number of failures. '''
+    built = []
+    failed = 0
+    start = time.perf_counter()
+    for tree in trees:
+        try:
+            cfg_class().parse_ast(tree)
+            built.append(tree)
+        except (SyntaxError, AttributeError, AssertionError,
+                RecursionError):
+            failed += 1
+    return built, time.perf_counter() - start, failed
+
+def print_all(trees):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for tree in trees:
+                try:
+                    PrintCFG(tree)
+                except AttributeError:
+                    # A function the builder never reached
+                    pass
+    return time.perf_counter() - start
+
+def count_graph(trees):
+    ''' The graphs of every module, class and function, so the blocks of
+        each graph built are counted against the time spent building it. '''
+    graphs = blocks = edges = 0
+    for tree in trees:
+        for node in tree.graphs.values():
+            graphs += 1
+            for block in number_blocks(node.initial_block)[0]:
+                blocks += 1
+                edges += len(block.exit_blocks)
+    return graphs, blocks, edges
+
+def run_workload(workload, mode, repeat, limit=None):
+    ''' Runs in a child process. '''
+    cfg_class = MODES[mode]
+    sources = workload_sources(workload, limit)
+    trees, parse_failed = parse_all(sources)
+    build_times = []
+    print_times = []
+    for i in range(repeat):
+        # Rebuilding replaces the graphs of the previous repeat, which would
+        # be freed inside the measurement, so only count the first
+        before = sys.getallocatedblocks()
+        built, build_time, failed = build_all(cfg_class, trees)
+        if not i:
+            allocated = sys.getallocatedblocks() - before
+        build_times.append(build_time)
+        print_times.append(print_all(built))
+    failed += parse_failed
+    graphs, blocks, edges = count_graph(built)
+    build_time = min(build_times)
+    return {
+        'workload': workload,
+        'mode': mode,
+        'files': len(sources),
+        'failed': failed,
+        'graphs': graphs,
+        'blocks': blocks,
+        'edges': edges,
+        'build_seconds': build_time,
+        'print_seconds': min(print_times),
+        'files_per_sec': len(sources) / build_time if build_time else 0.0,
+        'blocks_per_sec': blocks / build_time if build_time else 0.0,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'allocated_blocks': allocated,
+    }
+
+def run_isolated(workload, mode, repeat, limit=None):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_workload, workload, mode, repeat,
+                               limit).result()
+
+def baseline_mismatch(result, baseline):
+    ''' Describe how the baseline's keys differ from the result's, None if
+        they are the same. A baseline recorded before a metric was added,
+        renamed or redefined can not be compared. '''
+    missing = sorted(set(result) - set(baseline))
+    stale = sorted(set(baseline) - set(result))
+    if not missing and not stale:
+        return None
+    return '%s: baseline lacks %s and has stale %s; re-record it with ' \
+        '--update-baseline' % (result['workload'],
+                               ', '.join(missing) or 'nothing',
+                               ', '.join(stale) or 'nothing')
+
+def compare(result, baseline, tolerance):
+    ''' Return a description of every metric which has regressed. '''
+    regressions = []
+    for metric, bigger_is_better in METRICS.items():
+        expected = baseline.get(metric)
+        if not expected:
+            continue
+        actual = result[metric]
+        if bigger_is_better:
+            worse = actual < expected * (1 - tolerance)
+        else:
+            worse = actual > expected * (1 + tolerance)
+        if worse:
+            regressions.append('%s %s: %.1f, baseline %.1f (%+.1f%%)' % (
+                result['workload'], metric, actual, expected,
+                (actual - expected) * 100.0 / expected))
+    return regressions
+
+def format_change(result, baseline):
+    ''' The change in each metric from the baseline, as before -> after. '''
+    changes = []
+    for metric in ('build_seconds', 'files_per_sec', 'blocks_per_sec',
+                   'peak_rss_kb', 'allocated_blocks'):
+        expected = baseline.get(metric)
+        if not expected:
+            continue
+        actual = result[metric]
+        changes.append('%s %.4g -> %.4g (%+.1f%%)' % (
+            metric, expected, actual, (actual - expected) * 100.0 / expected))
+    return '    vs baseline: ' + ', '.join(changes)
+
+def format_result(result):
+    return ('%(workload)-13s %(mode)-10s files %(files)5d failed %(failed)4d '
+            'graphs %(graphs)6d blocks %(blocks)7d edges %(edges)7d\n'
+            '    build %(build_seconds).3fs  print %(print_seconds).3fs  '
+            '%(files_per_sec).1f files/s  %(blocks_per_sec).0f blocks/s  '
+            'peak RSS %(peak_rss_kb)d KB  allocated blocks '
+            '%(allocated_blocks)d' % result)
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workload', choices=WORKLOADS, action='append',
+                        help='workload to run, may be repeated (default all)')
+    parser.add_argument('--mode', choices=sorted(MODES), default='full')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only use the first LIMIT sources of each workload')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional regression (default 0.25)')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    results = []
+    regressions = []
+    for workload in args.workload or WORKLOADS:
+        result = run_isolated(workload, args.mode, args.repeat, args.limit)
+        results.append(result)
+        print(format_result(result))
+        key = '%s/%s' % (workload, args.mode)
+        if key in baseline and not args.update_baseline:
+            mismatch = baseline_mismatch(result, baseline[key])
+            if mismatch:
+                print('    ' + mismatch)
+                regressions.append(mismatch)
+                continue
+            print(format_change(result, baseline[key]))
+            regressions.extend(compare(result, baseline[key], args.tolerance))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        for result in results:
+            baseline['%s/%s' % (result['workload'], result['mode'])] = result
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline written to %s' % args.baseline)
+        return 0
+    if regressions:
+        print('\nREGRESSIONS against %s:' % args.baseline)
+        for regression in regressions:
+            print('    ' + regression)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
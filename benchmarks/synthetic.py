@@ -0,0 +1,83 @@
+'''
+Generators for synthetic benchmark sources.
+
+Every generator is deterministic so runs can be compared against a stored
+baseline. Each returns the source of a single function.
+'''
+
+def elif_ladder(n, name='elif_ladder'):
+    ''' if/elif chain with n branches. Nests n deep in the ast. '''
+    lines = ['def %s(x):' % name,
+             '    if x == 0:',
+             '        a = 0']
+    for i in range(1, n):
+        lines.append('    elif x == %d:' % i)
+        lines.append('        a = %d' % i)
+    lines.append('    return a')
+    return '\n'.join(lines) + '\n'
+
+def try_body(n, handlers=5, name='try_body'):
+    ''' A try with n straight line statements and several handlers. '''
+    lines = ['def %s(x):' % name,
+             '    try:']
+    for i in range(n):
+        lines.append('        a%d = x + %d' % (i, i))
+    for i in range(handlers):
+        lines.append('    except E%d:' % i)
+        lines.append('        x = %d' % i)
+    lines.append('    return x')
+    return '\n'.join(lines) + '\n'
+
+def loop_breaks(n, name='loop_breaks'):
+    ''' A loop whose body is n ifs which may each break or continue. '''
+    lines = ['def %s(items):' % name,
+             '    for x in items:']
+    for i in range(n):
+        lines.append('        if x == %d:' % i)
+        lines.append('            break' if i % 2 else '            continue')
+        lines.append('        x = x + 1')
+    lines.append('    return x')
+    return '\n'.join(lines) + '\n'
+
+def nested_ifs(depth, name='nested_ifs'):
+    ''' ifs nested depth deep. The tokenizer allows at most 100 levels. '''
+    lines = ['def %s(x):' % name]
+    for i in range(depth):
+        indent = '    ' * (i + 1)
+        lines.append('%sif x > %d:' % (indent, i))
+        lines.append('%s    x = x - 1' % indent)
+    lines.append('    return x')
+    return '\n'.join(lines) + '\n'
+
+def nested_loops(depth, width, name='nested_loops'):
+    ''' Loops nested depth deep, each with width statements and a break. '''
+    lines = ['def %s(items):' % name]
+    for i in range(depth):
+        indent = '    ' * (i + 1)
+        lines.append('%sfor x%d in items:' % (indent, i))
+        for j in range(width):
+            lines.append('%s    y = x%d + %d' % (indent, i, j))
+        lines.append('%s    if y:' % indent)
+        lines.append('%s        break' % indent)
+    lines.append('    return items')
+    return '\n'.join(lines) + '\n'
+
+def synthetic_sources():
+    ''' Many moderately sized generated functions, one per source. '''
+    sources = []
+    for i in range(20):
+        sources.append(('elif_ladder_%d' % i, elif_ladder(50 + i * 10)))
+        sources.append(('try_body_%d' % i, try_body(100 + i * 20)))
+        sources.append(('loop_breaks_%d' % i, loop_breaks(50 + i * 10)))
+        sources.append(('nested_loops_%d' % i, nested_loops(5, 10 + i)))
+    return sources
+
+def pathological_sources():
+    ''' Single functions at the limits of what the builder must handle. '''
+    return [
+        ('elif_ladder_1500', elif_ladder(1500)),
+        ('try_body_20000', try_body(20000)),
+        ('loop_breaks_5000', loop_breaks(5000)),
+        ('nested_ifs_95', nested_ifs(95)),
+        ('nested_loops_30', nested_loops(30, 50)),
+    ]
@@ -0,0 +1,323 @@
+'''
+Bit-vector dataflow analyses over the graph of a single function.
+
+Every fact the analysis tracks (a variable for liveness, a definition for
+reaching definitions) is given a bit, and the gen, kill, in and out sets of
+each block are Python ints used as bitsets. Union, intersection and
+difference are then single int operations however many facts there are.
+
+The solver is a worklist ordered by reverse postorder (postorder for
+backward problems) so a block is normally only revisited when a loop's back
+edge changes it, which keeps the number of passes to around the loop
+nesting depth.
+
+Blocks hold whole statements, so a compound statement such as an if or a
+for sits in the block which evaluates its test while its body is in other
+blocks. Only the parts of a compound statement which run in its own block
+(the test, the iterator and target, the context managers, decorators and
+defaults) are counted there. Names are not resolved across scopes: lambdas,
+comprehensions and nested functions are not looked inside, except for the
+parts of them which run in the enclosing scope.
+'''
+
+from src.compactgraph import (CompactCFG, number_blocks, predecessor_edges,
+                              reverse_postorder)
+from collections import namedtuple
+import heapq
+import abc
+import ast
+
+# A definition of name by the statement node in block. Parameters are
+# defined by the FunctionDef in the initial block
+Definition = namedtuple('Definition', ['name', 'block', 'node'])
+
+# Statement -> the fields of it which run in the block holding it
+COMPOUND_FIELDS = {
+    ast.If: ('test',),
+    ast.While: ('test',),
+    ast.For: ('iter', 'target'),
+    ast.AsyncFor: ('iter', 'target'),
+    ast.With: ('items',),
+    ast.AsyncWith: ('items',),
+    ast.Try: (),
+    ast.FunctionDef: ('decorator_list', 'args', 'returns'),
+    ast.AsyncFunctionDef: ('decorator_list', 'args', 'returns'),
+    ast.ClassDef: ('decorator_list', 'bases', 'keywords'),
+}
+if hasattr(ast, 'Match'):
+    COMPOUND_FIELDS[ast.Match] = ('subject',)
+if hasattr(ast, 'TryStar'):
+    COMPOUND_FIELDS[ast.TryStar] = ()
+
+COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+def statement_names(node):
+    ''' Return the names a statement uses and the names it binds, each in
+        source order. Uses are taken to happen before bindings, as they do
+        in an assignment. '''
+    uses = []
+    defs = []
+    fields = COMPOUND_FIELDS.get(node.__class__)
+    if fields is None:
+        stack = [node]
+    else:
+        stack = []
+        for field in reversed(fields):
+            value = getattr(node, field)
+            if isinstance(value, list):
+                stack.extend(reversed(value))
+            elif value is not None:
+                stack.append(value)
+    while stack:
+        child = stack.pop()
+        if isinstance(child, ast.Name):
+            if isinstance(child.ctx, ast.Load):
+                uses.append(child.id)
+            else:
+                defs.append(child.id)
+        elif isinstance(child, ast.Lambda):
+            # Only the defaults are evaluated here
+            stack.extend(reversed(child.args.defaults))
+            stack.extend(d for d in reversed(child.args.kw_defaults) if d)
+        elif isinstance(child, COMPREHENSIONS):
+            # Only the first iterable is evaluated here
+            stack.append(child.generators[0].iter)
+        elif isinstance(child, (ast.Import, ast.ImportFrom)):
+            for alias in child.names:
+                if alias.name != '*':
+                    defs.append(alias.asname or alias.name.split('.')[0])
+        else:
+            stack.extend(reversed(list(ast.iter_child_nodes(child))))
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        defs.append(node.name)
+    elif isinstance(node, ast.AugAssign) and \
+            isinstance(node.target, ast.Name):
+        # The target is read as well as written
+        uses.append(node.target.id)
+    return uses, defs
+
+def block_statements(block):
+    ''' The statements of a block. ControlFlowGraph can also add pieces of
+        multi-line expressions, which their statement already covers. '''
+    return [s for s in block.statements if isinstance(s, ast.stmt)]
+
+def iter_bits(bits):
+    ''' Yield the positions of the set bits, lowest first. '''
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+class DataflowAnalysis(abc.ABC):
+    ''' A monotone dataflow problem over one function's graph, solved on
+    construction.
+
+    Subclasses set forward and may, and give every block a gen and kill
+    bitset in find_gen_kill. Out of a block is gen | (in & ~kill) for a
+    forward problem, swapping in and out for a backward one. may chooses
+    union (true) or intersection (false) at join points.
+    '''
+
+    forward = True
+    may = True
+
+    def __init__(self, node):
+        ''' node is a FunctionDef, ClassDef or Module whose graph has been
+            built. '''
+        self.node = node
+        self.blocks, self.index = number_blocks(node.initial_block)
+        num_blocks = len(self.blocks)
+        graph = CompactCFG.from_block(node.initial_block)
+        offsets, targets = graph.flow_edges()
+        # The blocks keep their predecessors, so nothing need be inverted
+        inverted_offsets, inverted = predecessor_edges(self.blocks,
+                                                       self.index)
+        order = reverse_postorder(num_blocks, 0, offsets, targets)
+        if self.forward:
+            self.meet_offsets, self.meet_from = inverted_offsets, inverted
+            self.next_offsets, self.next_to = offsets, targets
+        else:
+            order.reverse()
+            self.meet_offsets, self.meet_from = offsets, targets
+            self.next_offsets, self.next_to = inverted_offsets, inverted
+        self.order = order
+        self.gen = [0] * num_blocks
+        self.kill = [0] * num_blocks
+        # Bits which may be set, used to start intersections
+        self.universe = 0
+        self.find_gen_kill()
+        # Facts on entry to and exit from each block, in the direction of
+        # flow. Blocks which can not be reached keep the empty set
+        self.ins = [0] * num_blocks
+        self.outs = [0] * num_blocks
+        # Number of times a block's transfer function was applied
+        self.visits = 0
+        self.solve()
+
+    @abc.abstractmethod
+    def find_gen_kill(self):
+        ''' Fill in gen and kill for every block, and universe. '''
+
+    def boundary(self):
+        ''' The facts flowing into the function's first block, or out of
+            the blocks where it ends for a backward problem. '''
+        return 0
+
+    def solve(self):
+        order = self.order
+        position = [-1] * len(self.blocks)
+        for i, b in enumerate(order):
+            position[b] = i
+        gen = self.gen
+        kill = self.kill
+        ins = self.ins
+        outs = self.outs
+        meet_offsets = self.meet_offsets
+        meet_from = self.meet_from
+        next_offsets = self.next_offsets
+        next_to = self.next_to
+        may = self.may
+        universe = self.universe
+        boundary = self.boundary()
+        if not may:
+            for b in order:
+                outs[b] = universe
+        # Positions in order of the blocks waiting to be visited
+        worklist = list(range(len(order)))
+        pending = bytearray([1]) * len(order)
+        while worklist:
+            i = heapq.heappop(worklist)
+            pending[i] = 0
+            b = order[i]
+            self.visits += 1
+            start = meet_offsets[b]
+            end = meet_offsets[b + 1]
+            # Entering the function, or leaving it, is one more edge
+            on_boundary = b == 0 if self.forward else start == end
+            if may:
+                facts = boundary if on_boundary else 0
+                for j in range(start, end):
+                    facts |= outs[meet_from[j]]
+            else:
+                facts = boundary if on_boundary else universe
+                for j in range(start, end):
+                    p = meet_from[j]
+                    if position[p] != -1:
+                        facts &= outs[p]
+            ins[b] = facts
+            out = gen[b] | (facts & ~kill[b])
+            if out == outs[b]:
+                continue
+            outs[b] = out
+            for j in range(next_offsets[b], next_offsets[b + 1]):
+                k = position[next_to[j]]
+                if k != -1 and not pending[k]:
+                    pending[k] = 1
+                    heapq.heappush(worklist, k)
+
+    def block_in(self, block):
+        ''' Facts on entry to block, in the direction of flow. '''
+        return self.ins[self.index[id(block)]]
+
+    def block_out(self, block):
+        return self.outs[self.index[id(block)]]
+
+class Liveness(DataflowAnalysis):
+    ''' Variables which may be read before being written again. Bit i is
+        variables[i]. '''
+
+    forward = False
+    may = True
+
+    def find_gen_kill(self):
+        self.variables = []
+        self.variable_ids = {}
+        for b, block in enumerate(self.blocks):
+            used = 0
+            defined = 0
+            for statement in block_statements(block):
+                uses, defs = statement_names(statement)
+                for name in uses:
+                    bit = 1 << self.variable_id(name)
+                    if not defined & bit:
+                        used |= bit
+                for name in defs:
+                    defined |= 1 << self.variable_id(name)
+            self.gen[b] = used
+            self.kill[b] = defined
+        self.universe = (1 << len(self.variables)) - 1
+
+    def variable_id(self, name):
+        try:
+            return self.variable_ids[name]
+        except KeyError:
+            self.variable_ids[name] = i = len(self.variables)
+            self.variables.append(name)
+            return i
+
+    def names(self, bits):
+        return {self.variables[i] for i in iter_bits(bits)}
+
+    def live_in(self, block):
+        ''' Names live on entry to block. '''
+        return self.names(self.block_out(block))
+
+    def live_out(self, block):
+        ''' Names live on exit from block. '''
+        return self.names(self.block_in(block))
+
+class ReachingDefinitions(DataflowAnalysis):
+    ''' Definitions which may reach a point without being overwritten. Bit
+        i is definitions[i]. '''
+
+    forward = True
+    may = True
+
+    def find_gen_kill(self):
+        self.definitions = []
+        # Name -> bits of every definition of it
+        self.defined_by = {}
+        initial_block = self.blocks[0]
+        parameters = []
+        args = getattr(self.node, 'args', None)
+        if args is not None:
+            parameters = args.posonlyargs + args.args + args.kwonlyargs
+            parameters += [a for a in (args.vararg, args.kwarg) if a]
+        defined_names = []
+        for b, block in enumerate(self.blocks):
+            # Name -> the block's last definition of it
+            last = {}
+            if block is initial_block:
+                for parameter in parameters:
+                    last[parameter.arg] = self.add_definition(
+                        parameter.arg, block, self.node)
+            for statement in block_statements(block):
+                for name in statement_names(statement)[1]:
+                    last[name] = self.add_definition(name, block, statement)
+            gen = 0
+            for i in last.values():
+                gen |= 1 << i
+            self.gen[b] = gen
+            defined_names.append(last)
+        # Every definition of a name the block defines is killed
+        defined_by = self.defined_by
+        for b, names in enumerate(defined_names):
+            kill = 0
+            for name in names:
+                kill |= defined_by[name]
+            self.kill[b] = kill
+        self.universe = (1 << len(self.definitions)) - 1
+
+    def add_definition(self, name, block, node):
+        i = len(self.definitions)
+        self.definitions.append(Definition(name, block, node))
+        self.defined_by[name] = self.defined_by.get(name, 0) | (1 << i)
+        return i
+
+    def reaching(self, block):
+        ''' Definitions reaching the start of block. '''
+        return [self.definitions[i] for i in iter_bits(self.block_in(block))]
+
+    def reaching_out(self, block):
+        ''' Definitions reaching the end of block. '''
+        return [self.definitions[i] for i in iter_bits(self.block_out(block))]
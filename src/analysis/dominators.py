@@ -0,0 +1,208 @@
+'''
+Dominator and post-dominator trees over a CompactCFG.
+
+Immediate dominators are found with the Cooper, Harvey and Kennedy iterative
+algorithm ("A Simple, Fast Dominance Algorithm") over a reverse postorder
+numbering. It converges in a couple of passes on the graphs the builder
+produces. Everything is then stored in flat arrays so that immediate
+dominators, dominance tests and dominance frontiers are O(1) lookups.
+
+Post-dominators are dominators of the reversed graph. Functions can have
+several places control leaves (the Exit block, blocks which just stop) so
+the reversed graph is rooted at a virtual exit numbered len(graph) which
+every such block flows to. Blocks which can never leave, such as the body of
+an infinite loop, have no post-dominator.
+'''
+
+from src.compactgraph import invert_edges, reverse_postorder
+from array import array
+
+class DominatorTree():
+
+    def __init__(self, num_nodes, root, offsets, targets, inverted_offsets,
+                 inverted):
+        ''' num_nodes nodes with successors (offsets, targets) and
+            predecessors (inverted_offsets, inverted), both CSR. Use
+            dominators() or post_dominators() rather than this. '''
+        self.root = root
+        rpo = reverse_postorder(num_nodes, root, offsets, targets)
+        # Position of each node in reverse postorder, -1 when unreachable
+        order = [-1] * num_nodes
+        for i, b in enumerate(rpo):
+            order[b] = i
+        idom = self.immediate_dominators(num_nodes, root, rpo, order,
+                                         inverted_offsets, inverted)
+        self.rpo = array('i', rpo)
+        self.idoms = array('i', idom)
+        self.number_tree(num_nodes)
+        self.find_frontiers(num_nodes, rpo, idom, inverted_offsets, inverted)
+
+    @classmethod
+    def dominators(cls, graph):
+        ''' Rooted at the function's initial block, id 0. '''
+        num_blocks = len(graph)
+        offsets, targets = graph.flow_edges()
+        inverted_offsets, inverted = invert_edges(num_blocks, offsets,
+                                                  targets)
+        return cls(num_blocks, 0, offsets, targets, inverted_offsets,
+                   inverted)
+
+    @classmethod
+    def post_dominators(cls, graph):
+        ''' Rooted at the virtual exit, id len(graph). '''
+        num_blocks = len(graph)
+        offsets, targets = graph.flow_edges()
+        virtual_exit = num_blocks
+        # Add the edges into the virtual exit
+        exit_offsets = array('i', [0])
+        exit_targets = array('i')
+        for b in range(num_blocks):
+            start = offsets[b]
+            end = offsets[b + 1]
+            exit_targets.extend(targets[start:end])
+            if start == end or b == graph.exit_index:
+                exit_targets.append(virtual_exit)
+            exit_offsets.append(len(exit_targets))
+        exit_offsets.append(len(exit_targets))
+        inverted_offsets, inverted = invert_edges(num_blocks + 1,
+                                                  exit_offsets, exit_targets)
+        # Successors in the reversed graph are the original predecessors
+        return cls(num_blocks + 1, virtual_exit, inverted_offsets, inverted,
+                   exit_offsets, exit_targets)
+
+    def immediate_dominators(self, num_nodes, root, rpo, order,
+                             inverted_offsets, inverted):
+        # Predecessors deepest first. Intersecting in that order only ever
+        # walks new_idom up the tree, rather than walking every predecessor
+        # up to it, which is quadratic for a handler reached from every
+        # statement of a long try body
+        preds = {}
+        for b in rpo:
+            preds[b] = sorted(inverted[inverted_offsets[b]:
+                                       inverted_offsets[b + 1]],
+                              key=order.__getitem__, reverse=True)
+        idom = [-1] * num_nodes
+        idom[root] = root
+        changed = True
+        while changed:
+            changed = False
+            for b in rpo[1:]:
+                new_idom = -1
+                for p in preds[b]:
+                    if idom[p] == -1:
+                        # Not processed yet or unreachable
+                        continue
+                    if new_idom == -1:
+                        new_idom = p
+                        continue
+                    # Walk both up the tree until they meet
+                    while p != new_idom:
+                        while order[p] > order[new_idom]:
+                            p = idom[p]
+                        while order[new_idom] > order[p]:
+                            new_idom = idom[new_idom]
+                if idom[b] != new_idom:
+                    idom[b] = new_idom
+                    changed = True
+        return idom
+
+    def number_tree(self, num_nodes):
+        ''' Number the dominator tree in pre and post order. a dominates b
+            exactly when b's interval lies inside a's. '''
+        idom = self.idoms
+        counts = [0] * (num_nodes + 1)
+        for b in range(num_nodes):
+            if idom[b] != -1 and b != self.root:
+                counts[idom[b] + 1] += 1
+        for b in range(num_nodes):
+            counts[b + 1] += counts[b]
+        self.child_offsets = array('i', counts)
+        self.children_of = array('i', [0]) * counts[-1]
+        fill = counts[:-1]
+        for b in range(num_nodes):
+            if idom[b] != -1 and b != self.root:
+                self.children_of[fill[idom[b]]] = b
+                fill[idom[b]] += 1
+        self.pre = array('i', [-1]) * num_nodes
+        self.post = array('i', [-1]) * num_nodes
+        counter = 0
+        stack = [(self.root, self.child_offsets[self.root])]
+        self.pre[self.root] = counter
+        counter += 1
+        while stack:
+            b, i = stack[-1]
+            if i < self.child_offsets[b + 1]:
+                stack[-1] = (b, i + 1)
+                child = self.children_of[i]
+                self.pre[child] = counter
+                counter += 1
+                stack.append((child, self.child_offsets[child]))
+            else:
+                stack.pop()
+                self.post[b] = counter
+                counter += 1
+
+    def find_frontiers(self, num_nodes, rpo, idom, inverted_offsets,
+                       inverted):
+        ''' Cooper, Harvey and Kennedy: walk up from each predecessor of a
+            join point until reaching the join point's immediate
+            dominator, or a node whose frontier already has the join point.
+            The root has no dominator above it, so for a root which is a
+            loop header the walk goes on past it. '''
+        root = self.root
+        frontiers = [None] * num_nodes
+        for b in rpo:
+            start = inverted_offsets[b]
+            end = inverted_offsets[b + 1]
+            # Entering the function is one more way into the root
+            if end - start < 2 and b != root:
+                continue
+            for i in range(start, end):
+                runner = inverted[i]
+                if idom[runner] == -1:
+                    continue
+                stop = idom[b] if b != root else -1
+                while runner != stop:
+                    frontier = frontiers[runner]
+                    if frontier is None:
+                        frontier = frontiers[runner] = []
+                    elif frontier[-1] == b:
+                        # An earlier walk for b went on from here already
+                        break
+                    frontier.append(b)
+                    runner = idom[runner] if runner != root else -1
+        self.frontier_offsets = array('i', [0])
+        self.frontier_targets = array('i')
+        for frontier in frontiers:
+            if frontier:
+                self.frontier_targets.extend(frontier)
+            self.frontier_offsets.append(len(self.frontier_targets))
+
+    def __len__(self):
+        return len(self.idoms)
+
+    def idom(self, b):
+        ''' Immediate dominator of b. The root is its own immediate
+            dominator. -1 when b is unreachable. '''
+        return self.idoms[b]
+
+    def is_reachable(self, b):
+        return self.idoms[b] != -1
+
+    def dominates(self, a, b):
+        ''' Does a dominate b. Every node dominates itself. '''
+        return self.pre[a] != -1 and self.pre[b] != -1 and \
+            self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]
+
+    def strictly_dominates(self, a, b):
+        return a != b and self.dominates(a, b)
+
+    def children(self, b):
+        ''' The nodes b immediately dominates. '''
+        return self.children_of[self.child_offsets[b]:
+                                self.child_offsets[b + 1]]
+
+    def frontier(self, b):
+        ''' Dominance frontier of b. '''
+        return self.frontier_targets[self.frontier_offsets[b]:
+                                     self.frontier_offsets[b + 1]]
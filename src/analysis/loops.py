@@ -0,0 +1,331 @@
+'''
+The loop nesting forest of a CompactCFG.
+
+Loops are found with Havlak's algorithm ("Nesting of Reducible and
+Irreducible Loops"). One depth first search numbers the blocks in preorder,
+so that the blocks a DFS tree ancestor reaches are an interval of numbers.
+Headers are then visited deepest first: the body of a header is what reaches
+one of its back edges without leaving its DFS subtree, and each body found
+is collapsed into its header with union-find so an enclosing loop sees it as
+one block. This takes near-linear time.
+
+A loop is irreducible when a block of its body is entered from outside it
+other than through the header, as when a loop is jumped into. Its header is
+then the entry the search reached first, and entries() gives the rest.
+
+The LOOP_HEADER tags the builder leaves are only hints and loops are found
+from the edges alone. A tagged block heads no loop when control never goes
+round, as for a while whose body always returns, and exception edges can
+make loops of their own. tagged says which loops the builder marked.
+
+Loops are numbered in preorder of their headers, so an enclosing loop comes
+before the loops nested in it. Blocks are listed loop by loop so that the
+body of a loop, nested loops included, is a slice of one array and
+contains() is O(1).
+'''
+
+from src.compactgraph import invert_edges
+from src.controlflowgraph import BlockTag
+from array import array
+
+class LoopForest():
+
+    def __init__(self, num_nodes, root, offsets, targets, inverted_offsets,
+                 inverted, tags=None):
+        ''' num_nodes nodes with successors (offsets, targets) and
+            predecessors (inverted_offsets, inverted), both CSR. Use
+            from_graph() rather than this. '''
+        self.root = root
+        number, last, nodes = self.number_nodes(num_nodes, root, offsets,
+                                                targets)
+        header_of, headers, irreducible = self.find_loops(
+            num_nodes, number, last, nodes, inverted_offsets, inverted)
+        self.headers = array('i', headers)
+        self.irreducible = array('b', irreducible)
+        self.tagged = array('b', [tags is not None and
+                                  tags[h] == BlockTag.LOOP_HEADER
+                                  for h in headers])
+        self.build_forest(num_nodes, header_of)
+        self.find_edges(number, last, nodes, offsets, targets)
+
+    @classmethod
+    def from_graph(cls, graph):
+        ''' Rooted at the function's initial block, id 0. '''
+        num_blocks = len(graph)
+        offsets, targets = graph.flow_edges()
+        inverted_offsets, inverted = invert_edges(num_blocks, offsets,
+                                                  targets)
+        return cls(num_blocks, 0, offsets, targets, inverted_offsets,
+                   inverted, graph.tags)
+
+    def number_nodes(self, num_nodes, root, offsets, targets):
+        ''' DFS preorder number of each node, -1 when unreachable, the
+            largest number in its subtree and the nodes in preorder. '''
+        number = [-1] * num_nodes
+        last = [-1] * num_nodes
+        nodes = [root]
+        number[root] = 0
+        stack = [(root, offsets[root])]
+        while stack:
+            b, i = stack[-1]
+            if i < offsets[b + 1]:
+                stack[-1] = (b, i + 1)
+                t = targets[i]
+                if number[t] == -1:
+                    number[t] = len(nodes)
+                    nodes.append(t)
+                    stack.append((t, offsets[t]))
+            else:
+                stack.pop()
+                last[b] = len(nodes) - 1
+        return number, last, nodes
+
+    def find_loops(self, num_nodes, number, last, nodes, inverted_offsets,
+                   inverted):
+        ''' Havlak. Returns the innermost header enclosing each node, -1
+            for none, with a header's being that of the loop around its own,
+            then the headers in preorder and whether each is irreducible. '''
+        back_preds = {}
+        non_back_preds = {}
+        for w in nodes:
+            back = []
+            non_back = []
+            low = number[w]
+            high = last[w]
+            for i in range(inverted_offsets[w], inverted_offsets[w + 1]):
+                v = inverted[i]
+                if number[v] == -1:
+                    continue
+                # A predecessor in the subtree of w closes a loop at w
+                if low <= number[v] <= high:
+                    back.append(v)
+                else:
+                    non_back.append(v)
+            if back:
+                back_preds[w] = back
+            non_back_preds[w] = non_back
+        # Union-find over nodes, each body collapsed into its header
+        parent = list(range(num_nodes))
+        def find(b):
+            while parent[b] != b:
+                parent[b] = parent[parent[b]]
+                b = parent[b]
+            return b
+        header_of = [-1] * num_nodes
+        # The header whose body a node was last added to
+        in_body = [-1] * num_nodes
+        found = []
+        for w in reversed(nodes):
+            back = back_preds.get(w)
+            if back is None:
+                continue
+            low = number[w]
+            high = last[w]
+            body = []
+            for v in back:
+                if v == w:
+                    continue
+                v = find(v)
+                if in_body[v] != w:
+                    in_body[v] = w
+                    body.append(v)
+            irreducible = False
+            worklist = list(body)
+            while worklist:
+                x = worklist.pop()
+                for y in non_back_preds[x]:
+                    y = find(y)
+                    if not low <= number[y] <= high:
+                        # Entered from outside other than through w
+                        irreducible = True
+                        non_back_preds[w].append(y)
+                    elif y != w and in_body[y] != w:
+                        in_body[y] = w
+                        body.append(y)
+                        worklist.append(y)
+            for x in body:
+                header_of[x] = w
+                parent[x] = w
+            found.append((w, irreducible))
+        found.reverse()
+        return (header_of, [w for w, irreducible in found],
+                [irreducible for w, irreducible in found])
+
+    def build_forest(self, num_nodes, header_of):
+        ''' Number the loops, their parents and depths, and list the blocks
+            so each loop's body is a slice. '''
+        num_loops = len(self.headers)
+        loop_headed = {}
+        for i, h in enumerate(self.headers):
+            loop_headed[h] = i
+        # Innermost loop of each block
+        innermost = array('i', [-1]) * num_nodes
+        for b in range(num_nodes):
+            if b in loop_headed:
+                innermost[b] = loop_headed[b]
+            elif header_of[b] != -1:
+                innermost[b] = loop_headed[header_of[b]]
+        self.innermost = innermost
+        self.parents = array('i', [-1]) * num_loops
+        self.depths = array('i', [1]) * num_loops
+        for i, h in enumerate(self.headers):
+            if header_of[h] != -1:
+                # An enclosing header comes earlier in preorder
+                p = loop_headed[header_of[h]]
+                self.parents[i] = p
+                self.depths[i] = self.depths[p] + 1
+        # The blocks directly in each loop other than its header, nested
+        # loops by their headers
+        counts = [0] * (num_loops + 1)
+        for b in range(num_nodes):
+            if header_of[b] != -1:
+                counts[loop_headed[header_of[b]] + 1] += 1
+        for i in range(num_loops):
+            counts[i + 1] += counts[i]
+        members = [0] * counts[-1]
+        fill = counts[:-1]
+        for b in range(num_nodes):
+            if header_of[b] != -1:
+                i = loop_headed[header_of[b]]
+                members[fill[i]] = b
+                fill[i] += 1
+        self.order = array('i')
+        self.position = array('i', [-1]) * num_nodes
+        self.body_start = array('i', [0]) * num_loops
+        self.body_end = array('i', [0]) * num_loops
+        order = self.order
+        for top in range(num_loops):
+            if self.parents[top] != -1:
+                continue
+            self.body_start[top] = len(order)
+            order.append(self.headers[top])
+            stack = [(top, counts[top])]
+            while stack:
+                loop, i = stack[-1]
+                if i < counts[loop + 1]:
+                    stack[-1] = (loop, i + 1)
+                    b = members[i]
+                    if b in loop_headed:
+                        inner = loop_headed[b]
+                        self.body_start[inner] = len(order)
+                        order.append(b)
+                        stack.append((inner, counts[inner]))
+                    else:
+                        order.append(b)
+                else:
+                    stack.pop()
+                    self.body_end[loop] = len(order)
+        for i, b in enumerate(order):
+            self.position[b] = i
+        self.child_offsets = array('i', [0]) * (num_loops + 1)
+        for p in self.parents:
+            if p != -1:
+                self.child_offsets[p + 1] += 1
+        for i in range(num_loops):
+            self.child_offsets[i + 1] += self.child_offsets[i]
+        self.children_of = array('i', [0]) * self.child_offsets[-1]
+        fill = self.child_offsets[:-1]
+        for i, p in enumerate(self.parents):
+            if p != -1:
+                self.children_of[fill[p]] = i
+                fill[p] += 1
+
+    def find_edges(self, number, last, nodes, offsets, targets):
+        ''' The back edges, exits and entries of every loop. An edge is only
+            looked at by the loops it leaves or enters, found by walking out
+            from the innermost loop of one end until a loop holds the other,
+            so the work is the size of the result. '''
+        num_loops = len(self.headers)
+        back_edges = [[] for i in range(num_loops)]
+        exits = [[] for i in range(num_loops)]
+        entries = [[] for i in range(num_loops)]
+        innermost = self.innermost
+        parents = self.parents
+        headers = self.headers
+        contains = self.contains
+        for h in range(num_loops):
+            # Entering the function is one more way into the root
+            if headers[h] == self.root:
+                entries[h].append(self.root)
+        for u in nodes:
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                loop = innermost[u]
+                while loop != -1 and not contains(loop, v):
+                    exits[loop].append((u, v))
+                    loop = parents[loop]
+                if loop != -1 and v == headers[loop]:
+                    back_edges[loop].append(u)
+                loop = innermost[v]
+                while loop != -1 and not contains(loop, u):
+                    if v not in entries[loop]:
+                        entries[loop].append(v)
+                    loop = parents[loop]
+        self.back_edge_offsets, self.back_edge_sources = \
+            self.flatten(back_edges)
+        self.exit_offsets, exit_edges = self.flatten(exits)
+        self.exit_sources = array('i', [u for u, v in exit_edges])
+        self.exit_targets = array('i', [v for u, v in exit_edges])
+        self.entry_offsets, self.entry_blocks = self.flatten(entries)
+        self.back_edge_sources = array('i', self.back_edge_sources)
+        self.entry_blocks = array('i', self.entry_blocks)
+
+    def flatten(self, lists):
+        ''' CSR offsets of lists and their items, one after the other. '''
+        offsets = array('i', [0])
+        flat = []
+        for items in lists:
+            flat.extend(items)
+            offsets.append(len(flat))
+        return offsets, flat
+
+    def __len__(self):
+        return len(self.headers)
+
+    def header(self, loop):
+        return self.headers[loop]
+
+    def loop_of(self, b):
+        ''' The innermost loop holding block b, -1 when there is none. '''
+        return self.innermost[b]
+
+    def depth(self, b):
+        ''' How many loops hold block b. '''
+        loop = self.innermost[b]
+        return self.depths[loop] if loop != -1 else 0
+
+    def contains(self, loop, b):
+        ''' Is block b in loop, or in a loop nested in it. '''
+        # Blocks in no loop are at -1
+        return self.body_start[loop] <= self.position[b] < self.body_end[loop]
+
+    def body(self, loop):
+        ''' The blocks of loop, header first, nested loops included. '''
+        return self.order[self.body_start[loop]:self.body_end[loop]]
+
+    def children(self, loop):
+        ''' The loops directly nested in loop. '''
+        return self.children_of[self.child_offsets[loop]:
+                                self.child_offsets[loop + 1]]
+
+    def roots(self):
+        ''' The loops not nested in any other. '''
+        return [loop for loop in range(len(self)) if self.parents[loop] == -1]
+
+    def back_edges(self, loop):
+        ''' The blocks of loop with an edge to its header. '''
+        return self.back_edge_sources[self.back_edge_offsets[loop]:
+                                      self.back_edge_offsets[loop + 1]]
+
+    def exits(self, loop):
+        ''' (block in loop, block outside it) of each edge leaving loop. '''
+        start = self.exit_offsets[loop]
+        end = self.exit_offsets[loop + 1]
+        return list(zip(self.exit_sources[start:end],
+                        self.exit_targets[start:end]))
+
+    def entries(self, loop):
+        ''' The blocks of loop control can come in at from outside it. Only
+            the header unless the loop is irreducible. '''
+        return self.entry_blocks[self.entry_offsets[loop]:
+                                 self.entry_offsets[loop + 1]]
@@ -0,0 +1,258 @@
+'''
+Metrics of every graph in a batch, computed with NumPy.
+
+GraphBatch flattens any number of CompactCFGs into a few NumPy arrays, the
+blocks of every graph numbered one after the other, and metrics() works
+out a row per graph with whole-array operations rather than a walk per
+function:
+
+    blocks          blocks of the graph, the Exit block included when it
+                    can be reached
+    edges           flow edges, as CompactCFG.flow_edges gives them
+    complexity      cyclomatic complexity, edges - blocks + 2
+    loop_headers    blocks tagged LOOP_HEADER
+    max_nesting     how deeply the statements of the graph are nested in
+                    the line spans of other statements, 0 for a graph of
+                    straight line code
+
+Nesting is found from the line spans the graph keeps, so an elif counts as
+an if nested in the else, as the ast has it. ControlFlowGraph also keeps the
+parts of multi-line expressions as statements, each nested in its
+statement; StatementCFG graphs give the nesting of statements alone.
+
+The result is a MetricsTable, a column per metric. write_csv writes it as
+text and to_bytes as METRICS_HEADER followed by the file paths, the graph
+names and then each column in turn, little endian whatever the machine.
+
+    python -m src.analysis.metrics metrics.bin some/dir other_file.py
+
+Needs NumPy, which nothing else in the package does.
+'''
+
+from src.batchbuilder import build_files
+from src.controlflowgraph import BlockTag
+from operator import attrgetter
+import numpy as np
+import argparse
+import struct
+import csv
+import sys
+
+METRICS_MAGIC = b'CFGM'
+METRICS_VERSION = 1
+# magic, version, rows, paths
+METRICS_HEADER = struct.Struct('<4sIII')
+
+# The numeric columns in the order they are written, with their types
+COLUMNS = (('file', '<i4'), ('lineno', '<i4'), ('blocks', '<i4'),
+           ('edges', '<i4'), ('complexity', '<i4'), ('loop_headers', '<i4'),
+           ('max_nesting', '<i4'))
+
+def concatenate(graphs, field, dtype):
+    ''' One NumPy array of the field array of every graph. This is most of
+        the work of a batch, so it is kept to loops in C: join takes the
+        arrays' buffers as they are. '''
+    return np.frombuffer(b''.join(map(attrgetter(field), graphs)),
+                         dtype=dtype)
+
+def lengths(graphs, field):
+    return np.fromiter(map(len, map(attrgetter(field), graphs)), np.int64,
+                       len(graphs))
+
+class GraphBatch():
+    ''' The graphs of a batch as flat arrays. Block b of graph g is block
+    block_offsets[g] + b of the batch, and statement s of graph g is
+    statement stmt_offsets[g] + s.
+    '''
+
+    def __init__(self, graphs, files=None, paths=()):
+        ''' graphs is a sequence of CompactCFGs. files gives the index in
+            paths of the file each graph came from, all 0 by default. '''
+        num_graphs = len(graphs)
+        self.paths = list(paths)
+        self.names = list(map(attrgetter('name'), graphs))
+        self.files = np.zeros(num_graphs, np.int32) if files is None else \
+            np.asarray(files, np.int32)
+        self.linenos = np.fromiter(map(attrgetter('lineno'), graphs),
+                                   np.int32, num_graphs)
+        block_counts = lengths(graphs, 'tags')
+        self.block_offsets = np.zeros(num_graphs + 1, np.int64)
+        np.cumsum(block_counts, out=self.block_offsets[1:])
+        # The graph each block is in
+        self.block_graphs = np.repeat(np.arange(num_graphs), block_counts)
+        self.tags = concatenate(graphs, 'tags', np.int8)
+
+        # Each graph's edge offsets have one more entry than it has blocks,
+        # so the difference across the end of a graph is not a block's
+        exit_counts = np.diff(concatenate(graphs, 'edge_offsets', np.int32))
+        self.exit_counts = np.delete(
+            exit_counts, self.block_offsets[1:-1] + np.arange(num_graphs - 1))
+        block_bases = self.block_offsets[:-1][self.block_graphs]
+        next_blocks = concatenate(graphs, 'next_blocks', np.int32)
+        self.next_blocks = np.where(next_blocks < 0, -1,
+                                    next_blocks + block_bases)
+        exit_targets = concatenate(graphs, 'edge_targets', np.int32)
+        exit_sources = np.repeat(np.arange(len(self.tags)), self.exit_counts)
+        # A block with no exits falls through to its next block
+        falls_through = np.flatnonzero((self.exit_counts == 0) &
+                                       (self.next_blocks >= 0))
+        self.edge_sources = np.concatenate((exit_sources, falls_through))
+        self.edge_targets = np.concatenate((
+            exit_targets + block_bases[exit_sources],
+            self.next_blocks[falls_through]))
+
+        stmt_counts = lengths(graphs, 'stmt_lines')
+        self.stmt_offsets = np.zeros(num_graphs + 1, np.int64)
+        np.cumsum(stmt_counts, out=self.stmt_offsets[1:])
+        self.stmt_lines = concatenate(graphs, 'stmt_lines', np.int32)
+        self.stmt_end_lines = concatenate(graphs, 'stmt_end_lines', np.int32)
+
+    @classmethod
+    def from_results(cls, results):
+        ''' The graphs of FileResults, as from batchbuilder.build_files. '''
+        graphs = []
+        files = []
+        paths = []
+        for result in results:
+            graphs.extend(result.functions)
+            files.extend([len(paths)] * len(result.functions))
+            paths.append(result.path)
+        return cls(graphs, files, paths)
+
+    def __len__(self):
+        return len(self.names)
+
+    def count_per_graph(self, block_values):
+        ''' The sum over the blocks of each graph of block_values. '''
+        return np.bincount(self.block_graphs, block_values,
+                           len(self)).astype(np.int32)
+
+    def max_nesting(self):
+        ''' A statement is nested in each statement of its graph whose span
+            runs past its own first line and starts before it. The graph is
+            the high half of each key so the spans of earlier graphs are
+            counted as both opened and closed, and cancel. '''
+        stmt_graphs = np.repeat(np.arange(len(self), dtype=np.int64),
+                                np.diff(self.stmt_offsets))
+        keys = stmt_graphs << 32
+        starts = keys | self.stmt_lines
+        spans = self.stmt_end_lines > self.stmt_lines
+        opened = np.sort(starts[spans])
+        closed = np.sort(keys[spans] | self.stmt_end_lines[spans])
+        depths = np.searchsorted(opened, starts) - \
+            np.searchsorted(closed, starts)
+        nesting = np.zeros(len(self), np.int32)
+        has_statements = np.flatnonzero(np.diff(self.stmt_offsets))
+        if len(has_statements):
+            nesting[has_statements] = np.maximum.reduceat(
+                depths, self.stmt_offsets[has_statements])
+        return nesting
+
+    def metrics(self):
+        blocks = np.diff(self.block_offsets).astype(np.int32)
+        edges = np.bincount(self.block_graphs[self.edge_sources],
+                            minlength=len(self)).astype(np.int32)
+        loop_headers = self.count_per_graph(
+            self.tags == BlockTag.LOOP_HEADER)
+        return MetricsTable(self.paths, self.names, {
+            'file': self.files, 'lineno': self.linenos, 'blocks': blocks,
+            'edges': edges, 'complexity': edges - blocks + 2,
+            'loop_headers': loop_headers,
+            'max_nesting': self.max_nesting()})
+
+def pack_strings(strings):
+    ''' Offsets then utf-8 bytes of strings, as written by to_bytes. '''
+    encoded = [s.encode('utf-8', 'surrogateescape') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, '<i8')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets.tobytes() + b''.join(encoded)
+
+def unpack_strings(buffer, offset, count):
+    offsets = np.frombuffer(buffer, '<i8', count + 1, offset)
+    offset += offsets.nbytes
+    data = bytes(buffer[offset:offset + int(offsets[-1])])
+    strings = [data[offsets[i]:offsets[i + 1]].decode('utf-8',
+                                                      'surrogateescape')
+               for i in range(count)]
+    return strings, offset + int(offsets[-1])
+
+class MetricsTable():
+    ''' A row per graph. columns maps each name in COLUMNS to a NumPy array,
+    file giving the row's index in paths.
+    '''
+
+    def __init__(self, paths, names, columns):
+        self.paths = paths
+        self.names = names
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def write_csv(self, f):
+        ''' f is a file opened for writing text with newline=''. '''
+        writer = csv.writer(f)
+        writer.writerow(['path', 'name'] + [name for name, _ in COLUMNS[1:]])
+        paths = self.paths
+        columns = [self.columns[name].tolist() for name, _ in COLUMNS]
+        for name, file, *values in zip(self.names, *columns):
+            writer.writerow([paths[file], name] + values)
+
+    def to_bytes(self):
+        parts = [METRICS_HEADER.pack(METRICS_MAGIC, METRICS_VERSION,
+                                     len(self), len(self.paths)),
+                 pack_strings(self.paths), pack_strings(self.names)]
+        parts.extend(np.asarray(self.columns[name], dtype).tobytes()
+                     for name, dtype in COLUMNS)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        ''' Read a table written by to_bytes from any buffer. The columns
+            are views of the buffer, not copies. '''
+        magic, version, rows, num_paths = METRICS_HEADER.unpack_from(buffer)
+        if magic != METRICS_MAGIC or version != METRICS_VERSION:
+            raise ValueError('not a version %d metrics table'
+                             % METRICS_VERSION)
+        offset = METRICS_HEADER.size
+        paths, offset = unpack_strings(buffer, offset, num_paths)
+        names, offset = unpack_strings(buffer, offset, rows)
+        columns = {}
+        for name, dtype in COLUMNS:
+            columns[name] = np.frombuffer(buffer, dtype, rows, offset)
+            offset += columns[name].nbytes
+        return cls(paths, names, columns)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Write the metrics of every graph of python files.')
+    parser.add_argument('out_path')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--format', choices=('binary', 'csv'),
+                        default='binary')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--statements-only', action='store_true')
+    parser.add_argument('--compress-exceptions', action='store_true')
+    parser.add_argument('--simplify', action='store_true')
+    args = parser.parse_args(argv)
+    results = list(build_files(args.paths, args.workers,
+                               statements_only=args.statements_only,
+                               compress_exceptions=args.compress_exceptions,
+                               simplify=args.simplify))
+    table = GraphBatch.from_results(results).metrics()
+    if args.format == 'csv':
+        with open(args.out_path, 'w', newline='') as f:
+            table.write_csv(f)
+    else:
+        with open(args.out_path, 'wb') as f:
+            f.write(table.to_bytes())
+    print('%d files, %d graphs, %d failed' % (
+        len(results), len(table),
+        sum(1 for result in results if result.error is not None)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
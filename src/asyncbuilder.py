@@ -0,0 +1,84 @@
+'''
+Builds control flow graphs with file reads overlapped with construction.
+
+On slow storage (network mounts, a cold cache) a batch spends most of its
+time waiting for reads. build_files_async reads ahead in a thread pool while
+the graphs of files already read are built, keeping at most window reads
+started but not yet built. When construction falls behind, reading waits
+for it.
+
+    async for result in build_files_async(paths, window=32):
+        ...
+
+Results are FileResults, as from batchbuilder.build_files, yielded in path
+order. Construction itself runs in the event loop's thread: it holds the GIL
+so more threads would not build any faster, and a build blocks the loop
+while reads already started carry on in their threads.
+'''
+
+from src.batchbuilder import (collect_source_files, read_source,
+                              build_source_cached)
+from src.cfgcache import DEFAULT_MAX_BYTES
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+async def build_files_async(paths, window=16, statements_only=False,
+                            compress_exceptions=False, simplify=False,
+                            read=read_source, cache_dir=None,
+                            cache_max_bytes=DEFAULT_MAX_BYTES):
+    ''' Async iterator of a FileResult for every python file under paths.
+        The build and cache options are those of batchbuilder.build_files.
+        read(file_path) returns the file's bytes and runs in a thread. '''
+    loop = asyncio.get_running_loop()
+    files = collect_source_files(paths)
+    # Reads in path order, each a file path and the future of its source
+    reads = asyncio.Queue()
+    # A slot is taken before a read starts and given back once its file is
+    # built. This is the backpressure
+    slots = asyncio.Semaphore(window)
+    executor = ThreadPoolExecutor(max_workers=window)
+
+    async def start_reads():
+        for file_path in files:
+            await slots.acquire()
+            future = loop.run_in_executor(executor, read, file_path)
+            await reads.put((file_path, future))
+        await reads.put(None)
+
+    reader = asyncio.ensure_future(start_reads())
+    try:
+        while True:
+            item = await reads.get()
+            if item is None:
+                break
+            file_path, future = item
+            source = await future
+            # Getting a queued item or a finished read does not yield, so
+            # let the reader top the window up before building
+            await asyncio.sleep(0)
+            result = build_source_cached(file_path, source, cache_dir,
+                                         statements_only, compress_exceptions,
+                                         simplify, cache_max_bytes)
+            slots.release()
+            yield result
+        await reader
+    finally:
+        # The consumer stopped early or a read failed
+        reader.cancel()
+        while not reads.empty():
+            item = reads.get_nowait()
+            if item is not None:
+                item[1].cancel()
+        executor.shutdown(wait=False)
+
+def build_files_pipelined(paths, window=16, statements_only=False,
+                          compress_exceptions=False, simplify=False,
+                          read=read_source, cache_dir=None,
+                          cache_max_bytes=DEFAULT_MAX_BYTES):
+    ''' Run build_files_async to completion and return the results. For
+        callers which are not themselves async. '''
+    async def collect():
+        return [result async for result in build_files_async(
+            paths, window, statements_only, compress_exceptions, simplify,
+            read, cache_dir, cache_max_bytes)]
+    return asyncio.run(collect())
@@ -0,0 +1,133 @@
+'''
+Builds control flow graphs for many files at once.
+
+Files are spread over a pool of worker processes. Live Block graphs are
+large and deeply linked so rather than pickling them each worker freezes
+every function's graph into a CompactCFG before returning it.
+'''
+
+from src.controlflowgraph import ControlFlowGraph, StatementCFG
+from src.compactgraph import CompactCFG
+from src.cfgcache import CFGCache, DEFAULT_MAX_BYTES
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from functools import partial
+import os
+
+# functions is a list of CompactCFG. error is None on success, otherwise a
+# description of why the file failed.
+FileResult = namedtuple('FileResult', ['path', 'functions', 'error'])
+
+# One cache per cache directory per process
+_caches = {}
+
+def collect_source_files(paths):
+    ''' Expand the given files and directories into a sorted list of python
+        source files. '''
+    if isinstance(paths, str):
+        paths = [paths]
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                # Sorting in place keeps the walk order deterministic
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith('.py'):
+                        found.append(os.path.join(dir_path, file_name))
+        else:
+            found.append(path)
+    return found
+
+def read_source(file_path):
+    ''' The bytes of the file. As ControlFlowGraph.get_source, unreadable
+        files are empty. '''
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read()
+    except IOError:
+        return b''
+
+def build_source(file_path, source, statements_only=False,
+                 compress_exceptions=False, simplify=False):
+    ''' Build the graphs for source, which may be bytes or str. Never raises
+        for a bad file, the reason is recorded in the result instead. '''
+    try:
+        cfg_class = StatementCFG if statements_only else ControlFlowGraph
+        cfg = cfg_class(compress_exceptions, simplify)
+        source_ast = cfg.source_to_ast(source, file_path)
+        cfg.parse_ast(source_ast)
+        return FileResult(file_path, CompactCFG.from_module(source_ast),
+                          None)
+    except SyntaxError as e:
+        # str(e) names the file. The result already does, and leaving it out
+        # lets the error be cached by content alone
+        return FileResult(file_path, [], '%s: %s (line %s)' % (
+            e.__class__.__name__, e.msg, e.lineno))
+    except (ValueError, RecursionError, AttributeError,
+            AssertionError) as e:
+        return FileResult(file_path, [], '%s: %s' % (e.__class__.__name__, e))
+
+def build_file(file_path, cache_dir=None, statements_only=False,
+               compress_exceptions=False, simplify=False,
+               cache_max_bytes=DEFAULT_MAX_BYTES):
+    ''' Worker entry point. With a cache_dir, files whose content has already
+        been built are loaded from the cache rather than parsed.
+        statements_only builds with StatementCFG, compress_exceptions and
+        simplify are passed on to the builder. '''
+    return build_source_cached(file_path, read_source(file_path), cache_dir,
+                               statements_only, compress_exceptions,
+                               simplify, cache_max_bytes)
+
+def build_source_cached(file_path, source, cache_dir=None,
+                        statements_only=False, compress_exceptions=False,
+                        simplify=False, cache_max_bytes=DEFAULT_MAX_BYTES):
+    ''' As build_source, through the cache in cache_dir when there is one.
+        The cache is kept under cache_max_bytes across every process using
+        it. '''
+    if cache_dir is None:
+        return build_source(file_path, source, statements_only,
+                            compress_exceptions, simplify)
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches[cache_dir] = CFGCache(cache_dir, cache_max_bytes)
+    cache.max_bytes = cache_max_bytes
+    variant = b''
+    if statements_only:
+        variant += b'statements;'
+    if compress_exceptions:
+        variant += b'compress_exceptions;'
+    if simplify:
+        variant += b'simplify;'
+    key = cache.key(source, variant)
+    cached = cache.get(key)
+    if cached is not None:
+        return FileResult(file_path, cached[0], cached[1])
+    result = build_source(file_path, source, statements_only,
+                          compress_exceptions, simplify)
+    cache.put(key, result.functions, result.error)
+    return result
+
+def build_files(paths, max_workers=None, chunksize=None, cache_dir=None,
+                statements_only=False, compress_exceptions=False,
+                simplify=False, cache_max_bytes=DEFAULT_MAX_BYTES):
+    ''' Build the graphs of every python file under paths, yielding a
+        FileResult per file in path order.
+        max_workers of 1 builds in this process without a pool. '''
+    files = collect_source_files(paths)
+    worker = partial(build_file, cache_dir=cache_dir,
+                     statements_only=statements_only,
+                     compress_exceptions=compress_exceptions,
+                     simplify=simplify, cache_max_bytes=cache_max_bytes)
+    if max_workers == 1:
+        for file_path in files:
+            yield worker(file_path)
+        return
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if chunksize is None:
+        # Large enough to amortise the IPC, small enough to balance load
+        chunksize = max(1, min(64, len(files) // (max_workers * 8)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(worker, files, chunksize=chunksize):
+            yield result
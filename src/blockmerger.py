@@ -0,0 +1,100 @@
+'''
+Merges control flow blocks with a union-find structure.
+
+An empty block which is merged into another takes on that block's identity.
+Rather than rewriting every reference to the absorbed block when the merge
+happens, each block keeps a merged_into pointer and references are resolved
+lazily with path compression. Once a function is finished resolve_graph
+rewrites the edges so that consumers only ever see surviving blocks.
+'''
+
+class BlockMerger():
+
+    def __init__(self):
+        # Number of merges performed. Useful for profiling
+        self.merges = 0
+
+    def find(self, block):
+        ''' Return the block which block has been merged into, if any.
+            Compresses the path as it goes so repeated lookups are O(1). '''
+        root = block
+        while root.merged_into is not None:
+            root = root.merged_into
+        while block.merged_into is not None and block.merged_into is not root:
+            next_block = block.merged_into
+            block.merged_into = root
+            block = next_block
+        return root
+
+    def merge(self, block, into):
+        ''' block, and everything already absorbed into it, now has the
+            identity of into. Returns the surviving block. '''
+        block = self.find(block)
+        into = self.find(into)
+        if block is not into:
+            block.merged_into = into
+            self.merges += 1
+        return into
+
+    def same_block(self, first, second):
+        return self.find(first) is self.find(second)
+
+    def resolve_graph(self, initial_block):
+        ''' Point every edge reachable from initial_block at its surviving
+            block, which can make two exits one, and give every block a new
+            tuple of its predecessors from the edges. Returns the surviving
+            initial block. '''
+        find = self.find
+        initial_block = find(initial_block)
+        initial_block.predecessors = []
+        # Blocks hash by identity. Every edge passes through here, so the
+        # blocks themselves are kept rather than their ids
+        seen = set([initial_block])
+        stack = [initial_block]
+        while stack:
+            block = stack.pop()
+            exits = block.exit_blocks
+            for e in exits:
+                if e.merged_into is not None:
+                    exits = block.exit_blocks = self.resolve_exits(exits)
+                    break
+            for e in exits:
+                if e not in seen:
+                    seen.add(e)
+                    # The shared exit keeps its own, empty, predecessors
+                    if e.tag != e.EXIT:
+                        e.predecessors = [block]
+                        stack.append(e)
+                else:
+                    e.predecessors.append(block)
+            next_block = block.next_block
+            if next_block is not None:
+                next_block = block.next_block = find(next_block)
+                if next_block not in seen:
+                    seen.add(next_block)
+                    if next_block.tag != next_block.EXIT:
+                        next_block.predecessors = [] if exits else [block]
+                        stack.append(next_block)
+                elif not exits:
+                    next_block.predecessors.append(block)
+            if block.next is not None:
+                block.next = find(block.next)
+        # A tuple is one allocation where a list is two, and the graph keeps
+        # one per block
+        for block in seen:
+            if block.tag != block.EXIT:
+                block.predecessors = tuple(block.predecessors)
+        return initial_block
+
+    def resolve_exits(self, exits):
+        ''' exits with each block replaced by its surviving block. Exits
+            merged into the same block become one. '''
+        find = self.find
+        resolved = []
+        present = set()
+        for e in exits:
+            e = find(e)
+            if e not in present:
+                present.add(e)
+                resolved.append(e)
+        return resolved
@@ -0,0 +1,220 @@
+'''
+A persistent on-disk cache of built control flow graphs.
+
+Entries are content addressed: the key is a hash of the source file's bytes,
+the cache format version and the source of the graph builder itself, so
+editing either a file or this tool invalidates the entry. Each entry holds
+every function of one file as CompactCFG records and is read back through
+mmap. The cache is kept under max_bytes by evicting the least recently used
+entries, recency being the entry's mtime which is touched on every hit.
+
+Any number of processes may share a cache directory, as the workers of
+batchbuilder.build_files do. The size of the whole directory is kept in a
+file of its own, updated under a lock by every put, so each process sees the
+others' writes. Eviction rescans the directory first. Without fcntl, as on
+Windows, the total is updated without the lock and may drift until the next
+eviction corrects it.
+'''
+
+from src.compactgraph import CompactCFG
+from collections import OrderedDict
+import contextlib
+import hashlib
+import struct
+import mmap
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump whenever the entry layout or what an entry holds changes. 2: errors
+# no longer name the file
+CACHE_VERSION = 2
+MAGIC = b'CFGC'
+# magic, version, number of graphs, error length
+ENTRY_HEADER = struct.Struct('<4sIIH')
+# Bytes of every entry in the directory, as written to SIZE_FILE
+SIZE_RECORD = struct.Struct('<Q')
+SIZE_FILE = 'size'
+LOCK_FILE = 'lock'
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Modules whose behaviour determines the graphs that are built, and
+# batchbuilder which describes the errors stored with them
+BUILDER_MODULES = ('controlflowgraph.py', 'compactgraph.py', 'blockmerger.py',
+                   'graphsimplifier.py', 'batchbuilder.py',
+                   os.path.join('traversers', 'astfulltraverser.py'),
+                   os.path.join('traversers', 'astbasetraverser.py'))
+
+_tool_digest = None
+
+def tool_digest():
+    ''' A hash of the builder's own source, computed once per process. '''
+    global _tool_digest
+    if _tool_digest is None:
+        h = hashlib.blake2b(digest_size=16)
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        for module in BUILDER_MODULES:
+            with open(os.path.join(src_dir, module), 'rb') as f:
+                h.update(f.read())
+        _tool_digest = h.digest()
+    return _tool_digest
+
+class CFGCache():
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Entry path -> size, least recently used first, as of the last scan
+        # of the directory
+        self.entries = None
+        # Bytes of the whole directory, as of the last put or scan
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source_bytes, variant=b''):
+        ''' variant distinguishes graphs built differently from one source. '''
+        h = hashlib.blake2b(digest_size=20)
+        h.update(struct.pack('<I', CACHE_VERSION))
+        h.update(tool_digest())
+        h.update(struct.pack('<H', len(variant)))
+        h.update(variant)
+        h.update(source_bytes)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.cfg')
+
+    def get(self, key):
+        ''' Return (functions, error) for the key or None on a miss. '''
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    result = self.read_entry(m)
+        except (OSError, ValueError, struct.error):
+            # Missing, evicted by another process or corrupt
+            self.misses += 1
+            return None
+        if result is None:
+            self.misses += 1
+            return None
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def read_entry(self, buffer):
+        magic, version, graphs, error_length = \
+            ENTRY_HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != CACHE_VERSION:
+            return None
+        offset = ENTRY_HEADER.size
+        error = None
+        if error_length:
+            error = buffer[offset:offset + error_length].decode('utf-8')
+            offset += error_length
+        functions = []
+        for i in range(graphs):
+            graph, offset = CompactCFG.from_buffer(buffer, offset)
+            functions.append(graph)
+        return functions, error
+
+    def put(self, key, functions, error=None):
+        error_bytes = (error or '').encode('utf-8')[:0xffff]
+        parts = [ENTRY_HEADER.pack(MAGIC, CACHE_VERSION, len(functions),
+                                   len(error_bytes)), error_bytes]
+        parts.extend(graph.to_bytes() for graph in functions)
+        data = b''.join(parts)
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial entry
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        with self.locked():
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = 0
+            os.replace(temp_path, path)
+            total = self.read_total()
+            if total is None:
+                self.scan()
+            else:
+                self.total_bytes = total + len(data) - replaced
+            if self.total_bytes > self.max_bytes:
+                # Other processes' hits have moved entries' mtimes since
+                # this one last looked
+                self.scan()
+                self.evict()
+            self.write_total()
+
+    @contextlib.contextmanager
+    def locked(self):
+        ''' Hold the directory's lock, shared by every process using it. '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, LOCK_FILE), 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_total(self):
+        ''' The size of the directory, None if it has not been recorded. '''
+        try:
+            with open(os.path.join(self.cache_dir, SIZE_FILE), 'rb') as f:
+                return SIZE_RECORD.unpack(f.read())[0]
+        except (OSError, struct.error):
+            return None
+
+    def write_total(self):
+        with open(os.path.join(self.cache_dir, SIZE_FILE), 'wb') as f:
+            f.write(SIZE_RECORD.pack(self.total_bytes))
+
+    def scan(self):
+        ''' Find every entry in the directory and how much they hold. '''
+        found = []
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith('.cfg'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime_ns, path, stat.st_size))
+        found.sort()
+        self.entries = OrderedDict((path, size) for mtime, path, size in found)
+        self.total_bytes = sum(self.entries.values())
+
+    def evict(self, target=None):
+        ''' Remove least recently used entries, as of the last scan, until
+            the cache is back under target bytes. By default 90% of
+            max_bytes, so that every put does not evict. '''
+        if target is None:
+            target = self.max_bytes * 0.9
+        while self.entries and self.total_bytes > target:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.locked():
+            self.scan()
+            self.evict(0)
+            self.write_total()
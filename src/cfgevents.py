@@ -0,0 +1,73 @@
+'''
+Observers of graph construction.
+
+Attach a CFGObserver to a ControlFlowGraph with add_observer to be told as
+blocks are created, edges added, blocks merged and graphs finished.
+Override only the events of interest. With no observer attached the builder
+only pays a test against None at each event.
+'''
+
+class CFGObserver():
+    ''' Receives construction events. Every method does nothing by default. '''
+
+    def block_created(self, block):
+        pass
+
+    def edge_added(self, source, dest):
+        ''' dest was added to source's exit_blocks. '''
+        pass
+
+    def block_merged(self, block, into):
+        ''' block was empty and has been merged into the block following
+            it. Edges to block are redirected when the graph is resolved. '''
+        pass
+
+    def function_finished(self, node):
+        ''' The graph of node, a FunctionDef, ClassDef or Module, has been
+            built. Merged blocks are not resolved until the run is
+            finished. '''
+        pass
+
+class ObserverGroup(CFGObserver):
+    ''' Passes every event on to several observers, in the order they were
+        added. '''
+
+    def __init__(self, observers):
+        self.observers = list(observers)
+
+    def block_created(self, block):
+        for observer in self.observers:
+            observer.block_created(block)
+
+    def edge_added(self, source, dest):
+        for observer in self.observers:
+            observer.edge_added(source, dest)
+
+    def block_merged(self, block, into):
+        for observer in self.observers:
+            observer.block_merged(block, into)
+
+    def function_finished(self, node):
+        for observer in self.observers:
+            observer.function_finished(node)
+
+class EventCounter(CFGObserver):
+    ''' Counts each kind of event. '''
+
+    def __init__(self):
+        self.blocks = 0
+        self.edges = 0
+        self.merges = 0
+        self.functions = 0
+
+    def block_created(self, block):
+        self.blocks += 1
+
+    def edge_added(self, source, dest):
+        self.edges += 1
+
+    def block_merged(self, block, into):
+        self.merges += 1
+
+    def function_finished(self, node):
+        self.functions += 1
@@ -0,0 +1,303 @@
+'''
+Where graph construction spends its time.
+
+A CFGProfiler attached to a ControlFlowGraph times each phase (parsing,
+building, add_to_block, merging, resolving) and each do_ handler, and counts
+the blocks, edges and merges and the deepest frame stack of every file and
+function built. Attaching replaces the builder's methods on that instance
+only, so a builder without a profiler runs exactly as before.
+
+Every timer records calls, total seconds and self seconds, which leave out
+the time spent in other timers nested inside it. Handlers of compound
+statements are generators, so their time is that of each step between child
+statements. Expression handlers only return their children, so the
+expressions phase is the sum of their seconds; visiting the children is
+counted in build. add_to_block is only called for a node on a new line.
+
+Results are returned by to_dict, or as a Chrome trace (load it in
+chrome://tracing or Perfetto) by chrome_trace when built with trace=True.
+
+    python -m src.cfgprofile some/dir --trace trace.json
+'''
+
+from src.cfgevents import CFGObserver
+from src.controlflowgraph import ControlFlowGraph, StatementCFG
+from src.batchbuilder import collect_source_files
+from types import GeneratorType
+from time import perf_counter
+import argparse
+import json
+import ast
+import sys
+import os
+
+PHASES = ('parse', 'build', 'add_to_block', 'merge', 'resolve')
+
+class TimedDispatch(dict):
+    ''' A dispatch table which builds a timed handler for each node class
+        the first time it is met. '''
+
+    def __init__(self, profiler, cfg):
+        dict.__init__(self)
+        self.profiler = profiler
+        self.cfg = cfg
+
+    def __missing__(self, node_class):
+        method = self.cfg.find_visitor(node_class)
+        handler = self[node_class] = self.profiler.timed_handler(node_class,
+                                                                 method)
+        return handler
+
+class CFGProfiler(CFGObserver):
+
+    def __init__(self, trace=False):
+        # Name -> [calls, seconds, self seconds]
+        self.phases = dict((phase, [0, 0.0, 0.0]) for phase in PHASES)
+        # Node class -> [calls, seconds, self seconds]
+        self.handlers = {}
+        self.files = []
+        self.functions = []
+        # Functions being built, innermost last
+        self.function_stack = []
+        self.current_file = None
+        # Seconds spent in timers nested in the one running now
+        self.child_seconds = 0.0
+        self.trace = trace
+        self.trace_events = []
+        self.origin = perf_counter()
+
+    def attach(self, cfg):
+        ''' Profile everything cfg builds from now on. '''
+        cfg.dispatch_table = TimedDispatch(self, cfg)
+        cfg.source_to_ast = self.timed_method('parse', cfg.source_to_ast,
+                                              self.parse_started)
+        cfg.run = self.timed_method('build', cfg.run)
+        cfg.build_function = self.timed_method('build', cfg.build_function)
+        add_to_block = self.timed_method('add_to_block', cfg.add_to_block)
+        def sampled_add_to_block(node):
+            self.frame_depth(len(cfg.frame_blocks))
+            return add_to_block(node)
+        cfg.add_to_block = sampled_add_to_block
+        cfg.resolve_functions = self.timed_method('resolve',
+                                                  cfg.resolve_functions)
+        cfg.merger.merge = self.timed_method('merge', cfg.merger.merge)
+        cfg.add_observer(self)
+
+    def detach(self, cfg):
+        for name in ('dispatch_table', 'source_to_ast', 'run',
+                     'build_function', 'add_to_block', 'resolve_functions'):
+            cfg.__dict__.pop(name, None)
+        cfg.merger.__dict__.pop('merge', None)
+        cfg.remove_observer(self)
+
+    def timed_method(self, phase, method, before=None):
+        stat = self.phases[phase]
+        def timed(*args, **kwargs):
+            if before is not None:
+                before(*args, **kwargs)
+            stat[0] += 1
+            outer = self.child_seconds
+            self.child_seconds = 0.0
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                self.add_time(stat, elapsed, outer)
+                if self.trace and phase in ('parse', 'build', 'resolve'):
+                    self.add_trace_event(phase, 'phase', start, elapsed)
+        return timed
+
+    def add_time(self, stat, elapsed, outer):
+        stat[1] += elapsed
+        stat[2] += elapsed - self.child_seconds
+        self.child_seconds = outer + elapsed
+
+    def timed_handler(self, node_class, method):
+        stat = self.handlers.setdefault(node_class, [0, 0.0, 0.0])
+        function = node_class.__name__ in ('FunctionDef', 'AsyncFunctionDef')
+        def handler(cfg, node):
+            if function:
+                self.start_function(node)
+            stat[0] += 1
+            outer = self.child_seconds
+            self.child_seconds = 0.0
+            start = perf_counter()
+            try:
+                result = method(cfg, node)
+            finally:
+                self.add_time(stat, perf_counter() - start, outer)
+            if result.__class__ is GeneratorType:
+                return self.timed_steps(result, stat, function)
+            if function:
+                self.finish_function()
+            return result
+        return handler
+
+    def timed_steps(self, steps, stat, function):
+        ''' Time each step of a compound statement's handler. '''
+        while True:
+            outer = self.child_seconds
+            self.child_seconds = 0.0
+            start = perf_counter()
+            try:
+                child = next(steps)
+            except StopIteration:
+                self.add_time(stat, perf_counter() - start, outer)
+                if function:
+                    self.finish_function()
+                return
+            self.add_time(stat, perf_counter() - start, outer)
+            yield child
+
+    def parse_started(self, source, file_path='<unknown>'):
+        self.start_file(file_path)
+
+    def start_file(self, file_path):
+        self.current_file = {'path': file_path, 'functions': 0, 'blocks': 0,
+                             'edges': 0, 'merges': 0, 'max_frame_depth': 0}
+        self.files.append(self.current_file)
+
+    def start_function(self, node):
+        if self.current_file is None:
+            self.start_file('<unknown>')
+        self.function_stack.append({
+            'path': self.current_file['path'], 'name': node.name,
+            'lineno': node.lineno, 'blocks': 0, 'edges': 0, 'merges': 0,
+            'max_frame_depth': 0, 'start': perf_counter()})
+
+    def finish_function(self):
+        record = self.function_stack.pop()
+        start = record.pop('start')
+        record['seconds'] = perf_counter() - start
+        self.functions.append(record)
+        self.current_file['functions'] += 1
+        if self.trace:
+            self.add_trace_event(record['name'], 'function', start,
+                                 record['seconds'],
+                                 {'lineno': record['lineno'],
+                                  'blocks': record['blocks'],
+                                  'edges': record['edges']})
+
+    def count(self, key):
+        if self.function_stack:
+            self.function_stack[-1][key] += 1
+        if self.current_file is not None:
+            self.current_file[key] += 1
+
+    def frame_depth(self, depth):
+        if self.function_stack:
+            record = self.function_stack[-1]
+            if depth > record['max_frame_depth']:
+                record['max_frame_depth'] = depth
+        if self.current_file is not None and \
+                depth > self.current_file['max_frame_depth']:
+            self.current_file['max_frame_depth'] = depth
+
+    def block_created(self, block):
+        self.count('blocks')
+
+    def edge_added(self, source, dest):
+        self.count('edges')
+
+    def block_merged(self, block, into):
+        self.count('merges')
+
+    def add_trace_event(self, name, category, start, seconds, args=None):
+        event = {'name': name, 'cat': category, 'ph': 'X',
+                 'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+                 'pid': os.getpid(), 'tid': 0}
+        if self.current_file is not None:
+            event['args'] = {'path': self.current_file['path']}
+        if args:
+            event.setdefault('args', {}).update(args)
+        self.trace_events.append(event)
+
+    def to_dict(self):
+        def timer(stat):
+            return {'calls': stat[0], 'seconds': stat[1],
+                    'self_seconds': stat[2]}
+        phases = dict((phase, timer(stat))
+                      for phase, stat in self.phases.items())
+        # Expression handlers never time one another, so their times add up
+        expressions = [0, 0.0, 0.0]
+        for node_class, stat in self.handlers.items():
+            if not issubclass(node_class, (ast.stmt, ast.mod,
+                                           ast.excepthandler)):
+                expressions[0] += stat[0]
+                expressions[1] += stat[2]
+                expressions[2] += stat[2]
+        phases['expressions'] = timer(expressions)
+        return {
+            'phases': phases,
+            'handlers': dict(('do_' + node_class.__name__, timer(stat))
+                             for node_class, stat in self.handlers.items()),
+            'files': self.files,
+            'functions': self.functions,
+        }
+
+    def chrome_trace(self):
+        ''' The trace in Chrome's trace event format. Empty unless the
+            profiler was made with trace=True. '''
+        return {'traceEvents': self.trace_events, 'displayTimeUnit': 'ms',
+                'otherData': self.to_dict()['phases']}
+
+def profile_files(paths, statements_only=False, compress_exceptions=False,
+                  simplify=False, trace=False):
+    ''' Build every python file under paths with one profiled builder per
+        file. Returns the profiler. '''
+    profiler = CFGProfiler(trace)
+    cfg_class = StatementCFG if statements_only else ControlFlowGraph
+    for file_path in collect_source_files(paths):
+        cfg = cfg_class(compress_exceptions, simplify)
+        profiler.attach(cfg)
+        try:
+            cfg.parse_file(file_path)
+        except (SyntaxError, ValueError, RecursionError, AttributeError,
+                AssertionError):
+            pass
+        # A failed build can leave functions unfinished
+        del profiler.function_stack[:]
+        profiler.child_seconds = 0.0
+    return profiler
+
+def format_report(profile, top=15):
+    lines = ['%-16s %10s %10s %10s' % ('phase', 'calls', 'seconds', 'self')]
+    for phase, stat in profile['phases'].items():
+        lines.append('%-16s %10d %10.3f %10.3f' % (
+            phase, stat['calls'], stat['seconds'], stat['self_seconds']))
+    lines.append('')
+    lines.append('%-16s %10s %10s %10s' % ('handler', 'calls', 'seconds',
+                                           'self'))
+    handlers = sorted(profile['handlers'].items(),
+                      key=lambda item: -item[1]['self_seconds'])
+    for name, stat in handlers[:top]:
+        lines.append('%-16s %10d %10.3f %10.3f' % (
+            name, stat['calls'], stat['seconds'], stat['self_seconds']))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Profile control flow graph construction.')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--statements-only', action='store_true')
+    parser.add_argument('--compress-exceptions', action='store_true')
+    parser.add_argument('--simplify', action='store_true')
+    parser.add_argument('--trace', help='write a Chrome trace to this file')
+    parser.add_argument('--json', help='write the full results to this file')
+    args = parser.parse_args(argv)
+    profiler = profile_files(args.paths, args.statements_only,
+                             args.compress_exceptions, args.simplify,
+                             bool(args.trace))
+    profile = profiler.to_dict()
+    print(format_report(profile))
+    if args.trace:
+        with open(args.trace, 'w') as f:
+            json.dump(profiler.chrome_trace(), f)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profile, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
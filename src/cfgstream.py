@@ -0,0 +1,196 @@
+'''
+Streams control flow graphs to disk as they are built.
+
+Each function or class graph is written as soon as the outermost function
+or class holding it is finished, and the module's own graph once the module
+is, then its blocks are dropped, and each file's ast is dropped
+once the file is done. Memory use therefore depends on the largest file
+rather than on how many files there are.
+
+Two formats are written:
+
+    jsonl   one json object per line, {"path": ..., "graph": {...}} where
+            graph is CompactCFG.to_dict(), or {"path": ..., "error": ...}
+            for a file which could not be built
+    binary  STREAM_HEADER then, per record, RECORD_PREFIX (path, error and
+            graph lengths) followed by the utf-8 path, the utf-8 error and a
+            CompactCFG.to_bytes() record. Native byte order like to_bytes
+
+A file which fails part way may already have had some of its graphs
+written before its error record. read_stream reads either format lazily,
+one record at a time.
+
+    python -m src.cfgstream graphs.jsonl some/dir other_file.py
+'''
+
+from src.controlflowgraph import ControlFlowGraph, StatementCFG
+from src.compactgraph import CompactCFG
+from src.batchbuilder import collect_source_files, read_source
+from collections import namedtuple
+from functools import partial
+import argparse
+import struct
+import json
+import sys
+
+STREAM_MAGIC = b'CFGS'
+STREAM_VERSION = 1
+# magic, version
+STREAM_HEADER = struct.Struct('<4sI')
+# path length, error length, graph record length
+RECORD_PREFIX = struct.Struct('<HII')
+
+# graph is a CompactCFG, or None with error describing why the file failed
+StreamRecord = namedtuple('StreamRecord', ['path', 'graph', 'error'])
+
+class JsonlWriter():
+
+    def __init__(self, f):
+        ''' f is a file opened for writing text. '''
+        self.f = f
+
+    def write(self, path, graph=None, error=None):
+        record = {'path': path}
+        if graph is not None:
+            record['graph'] = graph.to_dict()
+        else:
+            record['error'] = error
+        self.f.write(json.dumps(record, separators=(',', ':')))
+        self.f.write('\n')
+
+class BinaryWriter():
+
+    def __init__(self, f):
+        ''' f is a file opened for writing bytes. '''
+        self.f = f
+        f.write(STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION))
+
+    def write(self, path, graph=None, error=None):
+        path_bytes = path.encode('utf-8', 'surrogateescape')[:0xffff]
+        error_bytes = (error or '').encode('utf-8')
+        graph_bytes = graph.to_bytes() if graph is not None else b''
+        self.f.write(RECORD_PREFIX.pack(len(path_bytes), len(error_bytes),
+                                        len(graph_bytes)))
+        self.f.write(path_bytes)
+        self.f.write(error_bytes)
+        self.f.write(graph_bytes)
+
+WRITERS = {'jsonl': JsonlWriter, 'binary': BinaryWriter}
+
+class StreamExporter():
+
+    def __init__(self, writer, statements_only=False,
+                 compress_exceptions=False, simplify=False):
+        self.writer = writer
+        self.cfg_class = StatementCFG if statements_only else ControlFlowGraph
+        self.compress_exceptions = compress_exceptions
+        self.simplify = simplify
+        # Counts so far
+        self.files = 0
+        self.functions = 0
+        self.failed = 0
+
+    def export_files(self, paths):
+        for file_path in collect_source_files(paths):
+            self.export_source(file_path, read_source(file_path))
+
+    def export_source(self, file_path, source):
+        ''' Build and write the graphs of source, which may be bytes or
+            str. Never raises for a bad file, an error record is written
+            instead. '''
+        self.files += 1
+        # A fresh builder per file so nothing is carried between files
+        cfg = self.cfg_class(self.compress_exceptions, self.simplify)
+        cfg.function_finished = partial(self.write_function, file_path)
+        try:
+            source_ast = cfg.source_to_ast(source, file_path)
+            cfg.parse_ast(source_ast)
+        except (SyntaxError, ValueError, RecursionError, AttributeError,
+                AssertionError) as e:
+            self.failed += 1
+            self.writer.write(file_path,
+                              error='%s: %s' % (e.__class__.__name__, e))
+
+    def write_function(self, file_path, node):
+        self.writer.write(file_path, CompactCFG.from_function(node))
+        self.functions += 1
+        # Nothing needs the blocks once they are written
+        del node.initial_block
+
+def export_files(paths, out_path, format='jsonl', statements_only=False,
+                 compress_exceptions=False, simplify=False):
+    ''' Write the graphs of every python file under paths to out_path.
+        Returns the exporter, which holds the counts. '''
+    writer_class = WRITERS[format]
+    mode = 'w' if format == 'jsonl' else 'wb'
+    with open(out_path, mode) as f:
+        exporter = StreamExporter(writer_class(f), statements_only,
+                                  compress_exceptions, simplify)
+        exporter.export_files(paths)
+    return exporter
+
+def read_stream(path):
+    ''' Yield a StreamRecord for every record of a file written in either
+        format, reading one record at a time. '''
+    with open(path, 'rb') as f:
+        magic = f.read(len(STREAM_MAGIC))
+    if magic == STREAM_MAGIC:
+        return read_binary(path)
+    return read_jsonl(path)
+
+def read_jsonl(path):
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            graph = record.get('graph')
+            if graph is not None:
+                graph = CompactCFG.from_dict(graph)
+            yield StreamRecord(record['path'], graph, record.get('error'))
+
+def read_binary(path):
+    with open(path, 'rb') as f:
+        magic, version = STREAM_HEADER.unpack(f.read(STREAM_HEADER.size))
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError('%s is not a version %d cfg stream'
+                             % (path, STREAM_VERSION))
+        while True:
+            prefix = f.read(RECORD_PREFIX.size)
+            if not prefix:
+                return
+            if len(prefix) < RECORD_PREFIX.size:
+                raise ValueError('%s ends part way through a record' % path)
+            path_length, error_length, graph_length = \
+                RECORD_PREFIX.unpack(prefix)
+            body = f.read(path_length + error_length + graph_length)
+            if len(body) < path_length + error_length + graph_length:
+                raise ValueError('%s ends part way through a record' % path)
+            file_path = body[:path_length].decode('utf-8', 'surrogateescape')
+            error = body[path_length:path_length + error_length]
+            graph = None
+            if graph_length:
+                graph = CompactCFG.from_buffer(
+                    body, path_length + error_length)[0]
+            yield StreamRecord(file_path, graph,
+                               error.decode('utf-8') if error_length else None)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Stream the control flow graphs of python files to disk.')
+    parser.add_argument('out_path')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='jsonl')
+    parser.add_argument('--statements-only', action='store_true')
+    parser.add_argument('--compress-exceptions', action='store_true')
+    parser.add_argument('--simplify', action='store_true')
+    args = parser.parse_args(argv)
+    exporter = export_files(args.paths, args.out_path, args.format,
+                            args.statements_only, args.compress_exceptions,
+                            args.simplify)
+    print('%d files, %d functions, %d failed' % (
+        exporter.files, exporter.functions, exporter.failed))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
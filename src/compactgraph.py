@@ -0,0 +1,283 @@
+'''
+A frozen, array backed form of a finished control flow graph.
+
+Every block of a graph is given a dense integer id. Everything else is
+held in flat typed arrays indexed by those ids so no Block objects are kept
+alive once the graph has been built:
+
+    start_lines[b]                        line of the first statement
+    tags[b]                               a BlockTag
+    next_blocks[b]                        id of the next block, -1 for none
+    edge_targets[edge_offsets[b]:edge_offsets[b + 1]]
+                                          exits of block b
+    stmt_lines/stmt_end_lines[stmt_offsets[b]:stmt_offsets[b + 1]]
+                                          line span of each statement in b
+
+to_bytes gives a compact binary record: a fixed header followed by the raw
+arrays in native byte order. It is meant for local caches, not interchange.
+'''
+
+from src.controlflowgraph import MODULE_NAME, EXIT_BLOCK
+from array import array
+import struct
+import ast
+
+# lineno, exit_index, blocks, edges, statements, name length
+RECORD_HEADER = struct.Struct('<iiiiiH')
+
+def number_blocks(initial_block):
+    ''' Return the blocks reachable from initial_block, in the order PrintCFG
+        visits them, and a dict from block identity to its position. '''
+    index = {}
+    order = []
+    stack = [initial_block]
+    while stack:
+        block = stack.pop()
+        key = id(block)
+        if key in index:
+            continue
+        index[key] = len(order)
+        order.append(block)
+        if block is EXIT_BLOCK:
+            continue
+        if block.next_block:
+            stack.append(block.next_block)
+        stack.extend(reversed(block.exit_blocks))
+    return order, index
+
+def invert_edges(num_blocks, offsets, targets):
+    ''' Turn CSR successors into CSR predecessors. Each edge is kept, so a
+        block appears once per edge to its successor. '''
+    counts = [0] * (num_blocks + 1)
+    for t in targets:
+        counts[t + 1] += 1
+    for b in range(num_blocks):
+        counts[b + 1] += counts[b]
+    inverted_offsets = array('i', counts)
+    inverted = array('i', [0]) * len(targets)
+    fill = counts[:-1]
+    for b in range(num_blocks):
+        for i in range(offsets[b], offsets[b + 1]):
+            t = targets[i]
+            inverted[fill[t]] = b
+            fill[t] += 1
+    return inverted_offsets, inverted
+
+def predecessor_edges(blocks, index):
+    ''' CSR (offsets, sources) of the flow predecessors of blocks, a
+        resolved graph numbered by number_blocks. Read from each block's
+        predecessors, so unlike invert_edges nothing is inverted. The shared
+        exit keeps none, so its are found from the edges of the rest. '''
+    offsets = array('i', [0])
+    sources = array('i')
+    for block in blocks:
+        if block is EXIT_BLOCK:
+            sources.extend(index[id(b)] for b in blocks
+                           if EXIT_BLOCK in b.exit_blocks or
+                           (not b.exit_blocks and b.next_block is EXIT_BLOCK))
+        else:
+            sources.extend(index[id(p)] for p in block.predecessors)
+        offsets.append(len(sources))
+    return offsets, sources
+
+def reverse_postorder(num_blocks, root, offsets, targets):
+    ''' Blocks reachable from root in reverse postorder, following CSR
+        successors (offsets, targets). '''
+    postorder = []
+    visited = bytearray(num_blocks)
+    visited[root] = 1
+    # Each entry is a block and the position of its next successor
+    stack = [(root, offsets[root])]
+    while stack:
+        b, i = stack[-1]
+        if i < offsets[b + 1]:
+            stack[-1] = (b, i + 1)
+            t = targets[i]
+            if not visited[t]:
+                visited[t] = 1
+                stack.append((t, offsets[t]))
+        else:
+            stack.pop()
+            postorder.append(b)
+    postorder.reverse()
+    return postorder
+
+class CompactCFG():
+    ''' The graph of a single function. Cheap to keep and to pickle. '''
+
+    __slots__ = ('name', 'lineno', 'exit_index', 'start_lines', 'tags',
+                 'next_blocks', 'edge_offsets', 'edge_targets',
+                 'stmt_offsets', 'stmt_lines', 'stmt_end_lines')
+    # The array slots, in the order they are written by to_bytes
+    ARRAY_FIELDS = __slots__[3:]
+
+    def __init__(self, name, lineno):
+        self.name = name
+        self.lineno = lineno
+        # Id of the Exit block, -1 if it can not be reached
+        self.exit_index = -1
+        self.start_lines = array('i')
+        self.tags = array('b')
+        self.next_blocks = array('i')
+        self.edge_offsets = array('i', [0])
+        self.edge_targets = array('i')
+        self.stmt_offsets = array('i', [0])
+        self.stmt_lines = array('i')
+        self.stmt_end_lines = array('i')
+
+    @classmethod
+    def from_block(cls, initial_block, name='', lineno=0):
+        ''' Freeze the graph starting at initial_block. '''
+        graph = cls(name, lineno)
+        order, index = number_blocks(initial_block)
+        for i, block in enumerate(order):
+            graph.tags.append(block.tag)
+            if block is EXIT_BLOCK:
+                graph.exit_index = i
+                graph.start_lines.append(0)
+                graph.next_blocks.append(-1)
+                graph.edge_offsets.append(len(graph.edge_targets))
+                graph.stmt_offsets.append(len(graph.stmt_lines))
+                continue
+            graph.start_lines.append(block.start_line_no)
+            if block.next_block:
+                graph.next_blocks.append(index[id(block.next_block)])
+            else:
+                graph.next_blocks.append(-1)
+            graph.edge_targets.extend(index[id(e)]
+                                      for e in block.exit_blocks)
+            graph.edge_offsets.append(len(graph.edge_targets))
+            for statement in block.statements:
+                line = getattr(statement, 'lineno', 0)
+                graph.stmt_lines.append(line)
+                graph.stmt_end_lines.append(
+                    getattr(statement, 'end_lineno', None) or line)
+            graph.stmt_offsets.append(len(graph.stmt_lines))
+        return graph
+
+    @classmethod
+    def from_function(cls, node):
+        ''' Freeze the graph ControlFlowGraph attached to a FunctionDef,
+            ClassDef or Module. A module's graph is named <module> and
+            starts at line 0. '''
+        if node.__class__ is ast.Module:
+            return cls.from_block(node.initial_block, MODULE_NAME, 0)
+        return cls.from_block(node.initial_block, node.name, node.lineno)
+
+    @classmethod
+    def from_module(cls, source_ast):
+        ''' Freeze every graph of an already built module, ordered by line
+            number. A module built a function at a time has no index of its
+            graphs, so its tree is walked for them instead. '''
+        index = getattr(source_ast, 'graphs', None)
+        if index is not None:
+            # The index is already in line order
+            return [cls.from_function(node) for node in index.values()]
+        graphs = [cls.from_function(node) for node in ast.walk(source_ast)
+                  if getattr(node, 'initial_block', None) is not None]
+        graphs.sort(key=lambda g: g.lineno)
+        return graphs
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def arrays(self):
+        ''' The arrays in the order they are written by to_bytes. '''
+        return tuple(getattr(self, field) for field in self.ARRAY_FIELDS)
+
+    def to_dict(self):
+        ''' A form json can write. Arrays become lists. '''
+        d = {'name': self.name, 'lineno': self.lineno,
+             'exit_index': self.exit_index}
+        for field in self.ARRAY_FIELDS:
+            d[field] = getattr(self, field).tolist()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        graph = cls(d['name'], d['lineno'])
+        graph.exit_index = d['exit_index']
+        for field in cls.ARRAY_FIELDS:
+            typecode = getattr(graph, field).typecode
+            setattr(graph, field, array(typecode, d[field]))
+        return graph
+
+    def to_bytes(self):
+        name = self.name.encode('utf-8')
+        parts = [RECORD_HEADER.pack(self.lineno, self.exit_index, len(self),
+                                    len(self.edge_targets),
+                                    len(self.stmt_lines), len(name)),
+                 name]
+        parts.extend(a.tobytes() for a in self.arrays())
+        return b''.join(parts)
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        ''' Read a record written by to_bytes from any buffer, such as an
+            mmap. Returns the graph and the offset just past the record. '''
+        lineno, exit_index, blocks, edges, statements, name_length = \
+            RECORD_HEADER.unpack_from(buffer, offset)
+        offset += RECORD_HEADER.size
+        name = bytes(buffer[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        graph = cls(name, lineno)
+        graph.exit_index = exit_index
+        # The offset arrays already hold their leading zero
+        graph.edge_offsets = array('i')
+        graph.stmt_offsets = array('i')
+        lengths = (blocks, blocks, blocks, blocks + 1, edges, blocks + 1,
+                   statements, statements)
+        with memoryview(buffer) as view:
+            for a, length in zip(graph.arrays(), lengths):
+                size = a.itemsize * length
+                a.frombytes(view[offset:offset + size])
+                offset += size
+        return graph, offset
+
+    def flow_edges(self):
+        ''' Control flow successors of every block as CSR (offsets, targets).
+            The successors of a block are its exits. A block with no exits
+            falls through to its next block, as the block holding a try
+            statement does into the try body. '''
+        offsets = array('i', [0])
+        targets = array('i')
+        edge_offsets = self.edge_offsets
+        edge_targets = self.edge_targets
+        next_blocks = self.next_blocks
+        for b in range(len(self.tags)):
+            start = edge_offsets[b]
+            end = edge_offsets[b + 1]
+            if start != end:
+                targets.extend(edge_targets[start:end])
+            elif next_blocks[b] != -1:
+                targets.append(next_blocks[b])
+            offsets.append(len(targets))
+        return offsets, targets
+
+    def num_edges(self):
+        return len(self.edge_targets)
+
+    def is_exit(self, block_id):
+        return block_id == self.exit_index
+
+    def successors(self, block_id):
+        return self.edge_targets[self.edge_offsets[block_id]:
+                                 self.edge_offsets[block_id + 1]]
+
+    def statement_spans(self, block_id):
+        ''' (first line, last line) of each statement in the block. '''
+        start = self.stmt_offsets[block_id]
+        end = self.stmt_offsets[block_id + 1]
+        return list(zip(self.stmt_lines[start:end],
+                        self.stmt_end_lines[start:end]))
+
+    def nbytes(self):
+        ''' Memory held by the arrays. '''
+        return sum(a.itemsize * len(a) for a in self.arrays())
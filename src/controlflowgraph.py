@@ -3,45 +3,85 @@ Creates a control flow graph (cfg)
 '''
 
 from src.traversers.astfulltraverser import AstFullTraverser
+from src.blockmerger import BlockMerger
+from src.graphsimplifier import GraphSimplifier
+from src.cfgevents import ObserverGroup
+from bisect import bisect_left
+from enum import IntEnum
 import ast
 from pprint import pprint
 
+class BlockTag(IntEnum):
+    ''' Describes special blocks. Stored as a byte by CompactCFG. '''
+    NORMAL = 0
+    LOOP_HEADER = 1
+    EXIT = 2
+
+# The predecessors of a block until its graph is resolved, so a block which
+# is merged away or never reached allocates none
+NO_PREDECESSORS = ()
+
 class Block():
     ''' A basic control flow block.
 
     It has one entry point and several possible exit points.
     Note that the next_block is not necessarily an exit.
+    Blocks are slotted as graphs hold a great many of them. id numbers the
+    blocks of a graph densely in the order they were created; merging and
+    simplifying leave gaps.
     '''
-    
+
+    __slots__ = ('id', 'next_block', 'has_return', 'start_line_no',
+                 'statements', 'exit_blocks', 'predecessors', 'marked', 'tag',
+                 'next', 'merged_into', 'raises_to')
+
     # Block tags
-    NORMAL = 0
-    LOOP_HEADER = 1
+    NORMAL = BlockTag.NORMAL
+    LOOP_HEADER = BlockTag.LOOP_HEADER
+    EXIT = BlockTag.EXIT
 
-    def __init__(self):
+    def __init__(self, block_id=0, tag=BlockTag.NORMAL):
+        self.id = block_id
         # The next block along the function
         self.next_block = None
         self.has_return = False
         # Holds the statements in this block
         self.start_line_no = 0
         self.statements = []
+        # The blocks control can go to, each once, in the order added
         self.exit_blocks = []
+        # The blocks control can come from: those exiting to this one, and
+        # one whose only way on is its next_block. A tuple filled in when the
+        # graph is resolved, as merges move edges until then
+        self.predecessors = NO_PREDECESSORS
         # Use to indicate whether the block has been visited. Used for printing
         self.marked = False
         # Used to describe special blocks
-        self.tag = Block.NORMAL
-        # Block which have been absorbed into this one
-        self.dependents = []
-        
-    def copy_dict(self, copy_to):
-        ''' Keep the name bindings but copy the class instances.
-            Both bindings now point to the same variables.
-            This function is used to simulate C pointers.
-            TODO: Find a more elegant way of achieving this. '''
-        for dependent in self.dependents:
-            dependent.__dict__ = copy_to.__dict__
-        self.__dict__ = copy_to.__dict__
-        copy_to.dependents = self.dependents + [self]
+        self.tag = tag
+        # The block after an if or loop. Breaks exit to the loop's next
+        self.next = None
+        # Set once this block has been merged into another. See BlockMerger
+        self.merged_into = None
+        # The handlers any statement in this block may raise to. Only used by
+        # the compressed exception model
+        self.raises_to = None
         
+class NoPredecessors(list):
+    ''' A predecessor list which stays empty. '''
+
+    __slots__ = ()
+
+    def append(self, block):
+        pass
+
+# Every graph's returns, yields and end exit to this one block, so a block
+# is the exit exactly when it is EXIT_BLOCK. It never has exits or statements,
+# and keeps no predecessors as it is shared by every graph. start_line_no is
+# only for display
+EXIT_BLOCK = Block(-1, BlockTag.EXIT)
+EXIT_BLOCK.start_line_no = "Exit"
+EXIT_BLOCK.predecessors = NoPredecessors()
+
 # These are frame blocks.
 # Idea for these are from PyPy
 F_BLOCK_LOOP = 0
@@ -49,13 +89,111 @@ F_BLOCK_EXCEPT = 1
 F_BLOCK_FINALLY = 2
 F_BLOCK_FINALLY_END = 3
 
+class FrameStack():
+    ''' The frame blocks control flow is nested in, innermost last, each a
+    kind and a block.
+
+    The index of the innermost frame of each kind is kept up to date as frames
+    are pushed and popped, so finding the loop a break leaves or the handlers
+    a statement may raise to takes the same time however deep the nesting.
+    '''
+
+    __slots__ = ('frames', 'innermost')
+
+    def __init__(self):
+        # (kind, block, index of the innermost frame of kind outside it)
+        self.frames = []
+        # Kind -> index of its innermost frame, -1 if there is none
+        self.innermost = [-1] * (F_BLOCK_FINALLY_END + 1)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def push(self, kind, block):
+        self.frames.append((kind, block, self.innermost[kind]))
+        self.innermost[kind] = len(self.frames) - 1
+
+    def pop(self):
+        kind, block, outer = self.frames.pop()
+        self.innermost[kind] = outer
+        return kind, block
+
+    def block(self, index):
+        return self.frames[index][1]
+
+    def innermost_block(self, kind):
+        ''' The block of the innermost frame of kind, None if there is none. '''
+        index = self.innermost[kind]
+        if index < 0:
+            return None
+        return self.frames[index][1]
+
+# A block with this many exits finds whether it has one from a set rather
+# than by scanning them. Most have one or two, and only a statement in a try
+# with many handlers gets more
+EXIT_SET_MIN = 8
+
+# Statements whose test is put in a block of its own
+LOOP_TYPES = (ast.While, ast.For, ast.AsyncFor)
+
+# The qualified name of a module's own graph, as tracebacks name it
+MODULE_NAME = '<module>'
+
 class ControlFlowGraph(AstFullTraverser):
+    ''' Builds a graph for every module, class and function in an ast.
+
+    Each graph is attached to its node as initial_block. A class body runs
+    once, when the class statement does, so it has a graph like a function's.
+    Nested classes and functions are statements of the graph around them and
+    have graphs of their own. After a run the Module's graphs maps the
+    qualified name of each graph, as __qualname__ gives it, to its node.
     
-    def __init__(self):
+    By default each statement in a try body gets its own block with an exit
+    to every handler. With compress_exceptions, straight line statements in a
+    try body stay in one block, which exits to the handlers once and records
+    them in raises_to. That loses which statement raised but keeps graphs of
+    exception heavy code far smaller.
+
+    With simplify, each graph is passed through a GraphSimplifier once it is
+    resolved, and the simplifier's counts say how much was removed.
+
+    async def, async for and async with are treated as their synchronous
+    forms. An await suspends the function but always resumes at the same
+    place, so unlike a yield it does not end a block. The body of a with
+    statement is straight line code in the blocks around it.
+    '''
+    
+    def __init__(self, compress_exceptions=False, simplify=False):
+        self.compress_exceptions = compress_exceptions
+        # Shrinks each finished graph, None unless simplify
+        self.simplifier = GraphSimplifier() if simplify else None
         self.current_block = None
         # Used to hold how control flow is nested (e.g. if inside of a for)
-        self.frame_blocks = []
+        self.frame_blocks = FrameStack()
+        # The id the next block of the graph being built is given
+        self.block_count = 0
+        # What was put aside for each graph enclosing the one being built,
+        # innermost last. See enter_graph
+        self.scopes = []
+        # Prefix of the qualified names of graphs nested in this one
+        self.qualname_prefix = ''
+        # Qualified name -> node of every graph built, in line order
+        self.graphs = {}
         self.current_line_num = 0
+        # Handles merging empty blocks into the blocks that follow them
+        self.merger = BlockMerger()
+        # FunctionDefs whose graphs need resolving once the run is finished
+        self.built_functions = []
+        # Number of classes and functions being built, counting nested ones
+        self.function_depth = 0
+        # If set, called with each node as soon as its graph is final rather
+        # than when the run is finished
+        self.function_finished = None
+        # A CFGObserver told of construction events, None when there are none
+        self.observer = None
+        # Block -> set of its exits, kept for the blocks with at least
+        # EXIT_SET_MIN exits until their graph is resolved
+        self.exit_sets = {}
         
     def parse_ast(self, source_ast):
         self.run(source_ast)
@@ -67,7 +205,11 @@ class ControlFlowGraph(AstFullTraverser):
         
     def file_to_ast(self, file_path):
         s = self.get_source(file_path)
-        return ast.parse(s, filename = file_path, mode = 'exec')
+        return self.source_to_ast(s, file_path)
+
+    def source_to_ast(self, source, file_path='<unknown>'):
+        ''' source may be str or bytes. '''
+        return ast.parse(source, filename = file_path, mode = 'exec')
     
     def get_source(self, fn):
         ''' Return the entire contents of the file whose name is given.
@@ -81,7 +223,7 @@ class ControlFlowGraph(AstFullTraverser):
             return ''
         
     def push_frame_block(self, kind, block):
-        self.frame_blocks.append((kind, block))
+        self.frame_blocks.push(kind, block)
 
     def pop_frame_block(self, kind, block):
         actual_kind, old_block = self.frame_blocks.pop()
@@ -97,56 +239,118 @@ class ControlFlowGraph(AstFullTraverser):
             then the after blocks will be empty. All body/then/else exits will
             point to this block. If it is empty then swap for the given block.
             If it is not then set that block's exit as the given block. '''
+        find = self.merger.find
+        candidate_block = find(candidate_block)
+        after_control_block = find(after_control_block)
         if candidate_block.has_return:
             # If the block has a return exit then can not be given another here
             return
         if self.is_empty_block(candidate_block):
-            # candidate_block and after_control_block now point to the same
-            # variables. They are now the same instance.
-            candidate_block.copy_dict(after_control_block)
+            # candidate_block now has the identity of after_control_block.
+            # References to it are resolved when the function is finished.
+            self.merger.merge(candidate_block, after_control_block)
+            if self.observer is not None:
+                self.observer.block_merged(candidate_block,
+                                           after_control_block)
+            if candidate_block is self.current_block:
+                self.use_block(after_control_block)
             return
-        # This is needed to avoid two "Exits" appearing for the return or yield
-        # at the end of a function.
-        if not after_control_block in candidate_block.exit_blocks:
-            candidate_block.exit_blocks.append(after_control_block)
+        # An exit merged into after_control_block since it was added is
+        # only the same edge once the graph is resolved, which removes the
+        # repeat
+        self.add_to_exits(candidate_block, after_control_block)
             
     def add_to_block(self, node):
-        ''' We want every try statement to be in its own block. '''
+        ''' We want every try statement to be in its own block, unless
+            exceptions are compressed. '''
         if not self.current_block:
             return
+        # Nodes such as comprehension and arguments carry no line number
         # We only want the 'top level' statements
-        if self.current_line_num >= node.lineno:
+        if self.current_line_num >= getattr(node, 'lineno', 0):
             return   
         # Special cases - test must be in its own block
-        if isinstance(node, ast.While) or isinstance(node, ast.For):
+        if isinstance(node, LOOP_TYPES):
             if not self.is_empty_block(self.current_block):
                 test_block = self.new_block()
-                self.current_block.exit_blocks.append(test_block)
+                self.add_to_exits(self.current_block, test_block)
                 self.use_next_block(test_block)
         self.current_line_num = node.lineno
-        for f_block_type, f_block in reversed(self.frame_blocks):
-            if f_block_type == F_BLOCK_EXCEPT:
-                # Statement is in a try - set exits to next statement and
-                # excepts
-                self.current_block.statements.append(node)
-                for handler in f_block:
-                    self.current_block.exit_blocks.append(handler)
-                # Special case
-                if isinstance(node, ast.While) or isinstance(node, ast.For):
-                    break
-                next_statement_block = self.new_block()
-                self.current_block.exit_blocks.append(next_statement_block)
-                self.use_next_block(next_statement_block)
-                break
-        else:
-            self.current_block.statements.append(node)
+        self.current_block.statements.append(node)
+        handlers = self.frame_blocks.innermost_block(F_BLOCK_EXCEPT)
+        if handlers is None:
+            return
+        if self.compress_exceptions:
+            self.add_raise_exits(handlers)
+            return
+        # Statement is in a try - set exits to next statement and excepts
+        self.add_all_to_exits(self.current_block, handlers)
+        # Special case
+        if isinstance(node, LOOP_TYPES):
+            return
+        next_statement_block = self.new_block()
+        self.add_to_exits(self.current_block, next_statement_block)
+        self.use_next_block(next_statement_block)
     
+    def add_raise_exits(self, handlers):
+        ''' Compressed exception model. The handlers list is shared by every
+            block of the try body, so the check is a single identity test. '''
+        block = self.current_block
+        if block.raises_to is handlers:
+            return
+        block.raises_to = handlers
+        self.add_all_to_exits(block, handlers)
+
     def run(self, root):
         self.visit(root)
+        self.resolve_functions()
+
+    def build_function(self, node):
+        ''' Build the graph of a single FunctionDef on its own, rather than
+            as part of a run over its module. The qualified names in graphs
+            start from the function. '''
+        self.current_block = None
+        self.frame_blocks = FrameStack()
+        self.block_count = 0
+        self.scopes = []
+        self.qualname_prefix = ''
+        self.graphs = {}
+        self.current_line_num = 0
+        self.function_depth = 0
+        self.visit(node)
+        self.resolve_functions()
+        return node.initial_block
+
+    def resolve_functions(self):
+        ''' Blocks merged during construction are only resolved here, for
+            every graph finished since the last time. '''
+        for node in self.built_functions:
+            node.initial_block = self.merger.resolve_graph(node.initial_block)
+            if self.simplifier is not None:
+                node.initial_block = self.simplifier.simplify(
+                    node.initial_block)
+        self.built_functions = []
+        # Only a lookup: a set dropped here is made again from the exits
+        self.exit_sets.clear()
+
+    def finish_functions(self):
+        ''' Resolve the graphs of an outermost class or function and every
+            graph nested in it, or of the module once all of those are done,
+            then pass them to function_finished in line order. Nothing else
+            can change them once they are finished. '''
+        finished = self.built_functions
+        self.resolve_functions()
+        finished.sort(key=lambda node: getattr(node, 'lineno', 0))
+        for node in finished:
+            self.function_finished(node)
         
     def new_block(self):
         ''' From pypy. '''
-        return Block()
+        block = Block(self.block_count)
+        self.block_count += 1
+        if self.observer is not None:
+            self.observer.block_created(block)
+        return block
 
     def use_block(self, block):
         ''' From pypy. '''
@@ -165,45 +369,159 @@ class ControlFlowGraph(AstFullTraverser):
         return block
     
     def add_to_exits(self, source, dest):
-        source.exit_blocks.append(dest)
+        ''' An edge source already has is not added again. Short exit lists
+            are scanned and long ones looked up in exit_sets, so the check
+            does not grow with the handlers of a try. '''
+        exits = source.exit_blocks
+        if len(exits) < EXIT_SET_MIN:
+            if dest in exits:
+                return
+        else:
+            present = self.exit_sets.get(source)
+            if present is None:
+                present = self.exit_sets[source] = set(exits)
+            if dest in present:
+                return
+            present.add(dest)
+        exits.append(dest)
+        if self.observer is not None:
+            self.observer.edge_added(source, dest)
+
+    def add_all_to_exits(self, source, dests):
+        ''' As add_to_exits for each of dests, which are distinct and often
+            every handler of a try. '''
+        if not source.exit_blocks and self.observer is None:
+            source.exit_blocks.extend(dests)
+            return
+        for dest in dests:
+            self.add_to_exits(source, dest)
+
+    def add_observer(self, observer):
+        ''' Tell observer, a CFGObserver, of every construction event from
+            now on. '''
+        if self.observer is None:
+            self.observer = observer
+        elif isinstance(self.observer, ObserverGroup):
+            self.observer.observers.append(observer)
+        else:
+            self.observer = ObserverGroup([self.observer, observer])
+
+    def remove_observer(self, observer):
+        if self.observer is observer:
+            self.observer = None
+        elif isinstance(self.observer, ObserverGroup):
+            self.observer.observers.remove(observer)
+            if not self.observer.observers:
+                self.observer = None
         
     def visit(self, node):
-        '''Visit a single node. Callers are responsible for visiting children.'''
-        if self.check_has_return():
-            return
-        self.check_block_num(node)
-        self.add_to_block(node)
-        method = getattr(self, 'do_' + node.__class__.__name__)
-        return method(node)
-
-    def check_block_num(self, node):
-        ''' Used for display purposes only. Each block is labelled with the
-            line number of the the first statement in the block. '''
-        if not self.current_block:
-            return
-        if not self.current_block.start_line_no:
-            self.current_block.start_line_no = node.lineno
-            print(self.current_block.start_line_no )
-            
-    def check_has_return(self):
-        return self.current_block and self.current_block.has_return
-    
+        '''Visit a single node. Callers are responsible for visiting children.
+           Handlers for compound statements are generators which yield their
+           child statements, and handlers for expressions return their
+           children, instead of visiting them. Those are driven here with an
+           explicit stack so that nesting depth costs no recursion. Every
+           node costs a pass of the loop below, so it makes no call it can
+           do without. '''
+        dispatch_table = self.dispatch_table
+        stack = [iter((node,))]
+        while stack:
+            for child in stack[-1]:
+                block = self.current_block
+                if block:
+                    # Nothing after a return, break or continue is reachable
+                    if block.has_return:
+                        continue
+                    line = getattr(child, 'lineno', 0)
+                    # Used for display purposes only. Each block is labelled
+                    # with the line number of the first node in it
+                    if not block.start_line_no and line:
+                        block.start_line_no = line
+                    # Most nodes share a line with one added before them
+                    if line > self.current_line_num:
+                        self.add_to_block(child)
+                try:
+                    method = dispatch_table[child.__class__]
+                except KeyError:
+                    method = self.find_visitor(child.__class__)
+                children = method(self, child)
+                if children:
+                    # Finish the child's children before resuming this one
+                    stack.append(iter(children))
+                    break
+            else:
+                stack.pop()
+
+    def do_Module(self, node):
+        self.graphs = node.graphs = {}
+        return self.build_graph(node)
+
+    def do_ClassDef(self, node):
+        ''' The bases and decorators are evaluated in the enclosing graph. '''
+        for z in node.bases:
+            self.visit(z)
+        for z in node.keywords:
+            self.visit(z)
+        for z in node.decorator_list:
+            self.visit(z)
+        return self.build_graph(node)
+
     def do_FunctionDef(self, node):
+        return self.build_graph(node)
+
+    do_AsyncFunctionDef = do_FunctionDef
+
+    def build_graph(self, node):
+        ''' Build the graph of a module, class or function body. '''
+        nested = node.__class__ is not ast.Module
+        if nested:
+            self.function_depth += 1
+        self.enter_graph(node)
+        for z in node.body:
+            yield z
+        self.leave_graph(node)
+        if nested:
+            self.function_depth -= 1
+        if not self.function_depth and self.function_finished is not None:
+            self.finish_functions()
+
+    def enter_graph(self, node):
+        ''' Start node's graph, putting aside the state of the graph it is
+            nested in so that nothing built in one reaches the other. '''
+        self.scopes.append((self.current_block, self.frame_blocks,
+                            self.block_count, self.qualname_prefix))
+        if node.__class__ is ast.Module:
+            qualname = MODULE_NAME
+            self.qualname_prefix = ''
+        else:
+            qualname = self.qualname_prefix + node.name
+            if node.__class__ is ast.ClassDef:
+                self.qualname_prefix = qualname + '.'
+            else:
+                self.qualname_prefix = qualname + '.<locals>.'
+        # As in LazyCFG, a name defined again is keyed by its line too
+        if qualname in self.graphs:
+            qualname = '%s@%d' % (qualname, node.lineno)
+        self.graphs[qualname] = node
+        self.block_count = 0
         block = self.new_block()
         self.use_block(block)
         node.initial_block = block
-        self.exit_block = self.new_block()
-        # Special case
-        self.exit_block.start_line_no = "Exit"
-        for z in node.body:
-            self.visit(z)
+        self.frame_blocks = FrameStack()
+        # A body on the same line as the def, as in def f(): pass, is still
+        # added to the graph
+        self.current_line_num = getattr(node, 'lineno', 1) - 1
+
+    def leave_graph(self, node):
+        ''' Finish node's graph and go back to the one it is nested in. '''
         # Here there's a chance that the last block already points the exit.
         # Such as yields and returns
-        for e in self.current_block.exit_blocks:
-            if e.start_line_no == "Exit":
-                return
-        else:
-            self.check_child_exits(self.current_block, self.exit_block)
+        if EXIT_BLOCK not in self.current_block.exit_blocks:
+            self.check_child_exits(self.current_block, EXIT_BLOCK)
+        self.built_functions.append(node)
+        if self.observer is not None:
+            self.observer.function_finished(node)
+        (self.current_block, self.frame_blocks, self.block_count,
+         self.qualname_prefix) = self.scopes.pop()
             
     def do_If(self, node):
         ''' If an if statement is the last in a straight line then an empty
@@ -215,7 +533,7 @@ class ControlFlowGraph(AstFullTraverser):
         self.add_to_exits(if_block, then_block)
         self.use_block(then_block)
         for z in node.body:
-            self.visit(z)
+            yield z
         # Make sure the then exits point to the correct place
         self.check_child_exits(self.current_block, after_if_block)
         # Else block
@@ -224,7 +542,7 @@ class ControlFlowGraph(AstFullTraverser):
             self.add_to_exits(if_block, else_block)
             self.use_block(else_block)
             for z in node.orelse:
-                self.visit(z)
+                yield z
             # Make sure the else exits point to the correct place
             self.check_child_exits(self.current_block, after_if_block)
         else:
@@ -234,10 +552,56 @@ class ControlFlowGraph(AstFullTraverser):
         self.use_block(after_if_block)
         
     def do_While(self, node):
-        self.do_Loop(node)
+        return self.do_Loop(node)
         
     def do_For(self, node):
-        self.do_Loop(node)
+        return self.do_Loop(node)
+
+    do_AsyncFor = do_For
+
+    def do_With(self, node):
+        ''' Nothing is done about __exit__ suppressing an exception. '''
+        for item in node.items:
+            self.visit(item.context_expr)
+            if item.optional_vars:
+                self.visit(item.optional_vars)
+        for z in node.body:
+            yield z
+
+    do_AsyncWith = do_With
+
+    def do_Match(self, node):
+        ''' The block holding the match exits to the body of each case, as
+            an if/elif chain does, and to the block after the match unless
+            some case always matches. Patterns and guards are not visited. '''
+        match_block = self.current_block
+        after_match_block = self.new_block()
+        for case in node.cases:
+            case_block = self.new_block()
+            self.add_to_exits(match_block, case_block)
+            self.use_block(case_block)
+            for z in case.body:
+                yield z
+            self.check_child_exits(self.current_block, after_match_block)
+        if not any(self.is_irrefutable(case) for case in node.cases):
+            self.add_to_exits(match_block, after_match_block)
+        match_block.next = after_match_block
+        self.use_block(after_match_block)
+
+    def is_irrefutable(self, case):
+        ''' Does the case match every subject. '''
+        if case.guard is not None:
+            return False
+        patterns = [case.pattern]
+        while patterns:
+            pattern = patterns.pop()
+            if isinstance(pattern, ast.MatchAs):
+                if pattern.pattern is None:
+                    return True
+                patterns.append(pattern.pattern)
+            elif isinstance(pattern, ast.MatchOr):
+                patterns.extend(pattern.patterns)
+        return False
         
     def do_Loop(self, node):
         ''' For and While loops are treated the same. The only difference is
@@ -260,7 +624,7 @@ class ControlFlowGraph(AstFullTraverser):
         test_block.next = after_loop_block
         self.use_block(loop_body_block)
         for z in node.body:
-            self.visit(z)
+            yield z
         self.check_child_exits(self.current_block, test_block)
         self.pop_frame_block(F_BLOCK_LOOP, test_block)
         
@@ -270,7 +634,7 @@ class ControlFlowGraph(AstFullTraverser):
             self.use_block(else_body)
             else_body.next = after_loop_block
             for z in node.orelse:
-                self.visit(z)
+                yield z
             self.check_child_exits(self.current_block, after_loop_block)
         else:
             self.add_to_exits(test_block, after_loop_block)
@@ -283,65 +647,128 @@ class ControlFlowGraph(AstFullTraverser):
             In a try, returns go to the finally block. '''
         if node.value:
             self.visit(node.value)
+        self.add_return_exit()
+
+    def add_return_exit(self):
         # Check if the block is an try-finally.
-        for f_block_type, f_block in reversed(self.frame_blocks):
-            if f_block_type == F_BLOCK_FINALLY:
-                return_exit = f_block
-                break
-        else:
-            return_exit = self.exit_block
-        self.current_block.exit_blocks.append(return_exit)
+        return_exit = self.frame_blocks.innermost_block(F_BLOCK_FINALLY)
+        if return_exit is None:
+            return_exit = EXIT_BLOCK
+        self.add_to_exits(self.current_block, return_exit)
         self.current_block.has_return = True
         
     def do_Continue(self, node):
-        ''' Continues can not be in a finally block.
-            TODO: Fix this up.  '''
-        if not self.frame_blocks:
+        ''' A continue goes back to the header of the innermost loop. Since
+            Python 3.8 that includes a continue in a finally body, which
+            drops any exception the finally was run for. '''
+        loop_block = self.frame_blocks.innermost_block(F_BLOCK_LOOP)
+        if loop_block is None:
             self.error("'continue' not properly in loop", node)
-        current_block, block = self.frame_blocks[-1]
-        if current_block == F_BLOCK_LOOP:
-            self.current_block.exit_blocks.append(block)
-        elif current_block == F_BLOCK_EXCEPT or \
-                current_block == F_BLOCK_FINALLY:
-            # Find the loop
-            for i in range(len(self.frame_blocks) - 2, -1, -1):
-                f_type, block = self.frame_blocks[i]
-                if f_type == F_BLOCK_LOOP:
-                    self.current_block.exit_blocks.append(block)
-                    break
-                if f_type == F_BLOCK_FINALLY_END:
-                    self.error("'continue' not supported inside 'finally' "
-                                   "clause", node)
-            else:
-                self.error("'continue' not properly in loop", node)
-                return
-        elif current_block == F_BLOCK_FINALLY_END:
-            self.error("'continue' not supported inside 'finally' clause", node)
+        self.add_to_exits(self.current_block, loop_block)
         self.current_block.has_return = True
     
     def do_Break(self, node):
         ''' A break can only be in a loop.
             A break causes the current block to exit to block after the loop
             header (its next) '''
-        # Find first loop in stack
-        for f_block_type, f_block in reversed(self.frame_blocks):
-            if f_block_type == F_BLOCK_LOOP:
-                self.current_block.exit_blocks.append(f_block.next)
-                break
-        else:
+        loop_block = self.frame_blocks.innermost_block(F_BLOCK_LOOP)
+        if loop_block is None:
             self.error("'break' outside loop", node)
+        self.add_to_exits(self.current_block, loop_block.next)
         self.current_block.has_return = True
+
+    def error(self, message, node):
+        ''' Raise a SyntaxError for code which ast.parse accepts but the
+            compiler rejects, with the message the compiler gives. '''
+        raise SyntaxError(message, (None, node.lineno, node.col_offset + 1,
+                                    None))
         
     def do_Yield(self, node):
         ''' Here we deal with the control flow when the iterator goes through
             the function.
             We don't set has_return to true since, in theory, it can either
             exit or continue from here. '''
-        self.current_block.exit_blocks.append(self.exit_block)
+        self.add_to_exits(self.current_block, EXIT_BLOCK)
         next_block = self.new_block()
-        self.current_block.exit_blocks.append(next_block)
+        self.add_to_exits(self.current_block, next_block)
         self.use_next_block(next_block)
-        
+
+    do_YieldFrom = do_Yield
+
+    # Expressions with children return them, in the order AstFullTraverser
+    # visits them, rather than visiting them, so that deep expressions are
+    # driven by visit's stack too. A tuple costs less than a generator
+
+    def do_arguments(self, node):
+        return (*node.args, *node.defaults)
+
+    def do_arg(self, node):
+        if node.annotation:
+            return (node.annotation,)
+
+    def do_BinOp(self, node):
+        return node.left, node.right
+
+    def do_BoolOp(self, node):
+        return node.values
+
+    def do_Call(self, node):
+        return (node.func, *node.args, *node.keywords)
+
+    def do_Compare(self, node):
+        return (node.left, *node.comparators)
+
+    def do_comprehension(self, node):
+        return (node.target, node.iter, *node.ifs)
+
+    def do_Dict(self, node):
+        # A None key is a ** unpacking
+        return (*filter(None, node.keys), *node.values)
+
+    def do_DictComp(self, node):
+        return (node.key, node.value, *node.generators)
+
+    def do_GeneratorExp(self, node):
+        return (node.elt, *node.generators)
+
+    do_ListComp = do_SetComp = do_GeneratorExp
+
+    def do_IfExp(self, node):
+        return node.body, node.test, node.orelse
+
+    def do_JoinedStr(self, node):
+        return node.values
+
+    def do_FormattedValue(self, node):
+        if node.format_spec:
+            return node.value, node.format_spec
+        return (node.value,)
+
+    def do_List(self, node):
+        return node.elts
+
+    do_Tuple = do_List
+
+    def do_NamedExpr(self, node):
+        return node.target, node.value
+
+    def do_Slice(self, node):
+        return tuple(filter(None, (node.lower, node.upper, node.step)))
+
+    def do_Subscript(self, node):
+        return node.value, node.slice
+
+    def do_UnaryOp(self, node):
+        return (node.operand,)
+
+    def do_Lambda(self, node):
+        return node.args, node.body
+
+    def do_Attribute(self, node):
+        return (node.value,)
+
+    do_Await = do_Starred = do_keyword = do_Attribute
+
     def do_Try(self, node):
         ''' It is a great ordeal to find out which statements can cause which
             exceptions. Assume every statement can cause any exception. So
@@ -351,11 +778,19 @@ class ControlFlowGraph(AstFullTraverser):
             statement should point to the else.
             
             nested try-finallys go to each other during a return 
-            TODO'''
+            TODO
+
+            In a try/except* more than one handler can run, each for the
+            part of an exception group it matches, so each handler may go on
+            to any later one. '''
         after_try_block = self.new_block()
         final_block = None
         try_body_block = self.new_block()
         self.current_block.next_block = try_body_block
+        if self.current_block.exit_blocks:
+            # The try statement's block already raises to the handlers of an
+            # enclosing try, so it no longer falls through to its next block
+            self.add_to_exits(self.current_block, try_body_block)
         orelse_block = self.new_block()
         
         before_line_no = self.current_line_num
@@ -365,22 +800,28 @@ class ControlFlowGraph(AstFullTraverser):
             self.use_block(final_block)
             self.push_frame_block(F_BLOCK_FINALLY_END, node)
             for z in node.finalbody:
-                self.visit(z)
+                yield z
             self.pop_frame_block(F_BLOCK_FINALLY_END, node)
             self.check_child_exits(self.current_block, after_try_block)
         self.current_line_num = before_line_no
         
         before_line_no = self.current_line_num
-        exception_handlers = []
-        for handler in node.handlers:
+        exception_handlers = [self.new_block() for handler in node.handlers]
+        star = node.__class__.__name__ == 'TryStar'
+        for i, handler in enumerate(node.handlers):
             assert isinstance(handler, ast.ExceptHandler)
-            initial_handler_block = self.new_block()
-            self.use_block(initial_handler_block)
+            self.use_block(exception_handlers[i])
             for z in handler.body:
-                self.visit(z)
+                yield z
             handler_exit = final_block if node.finalbody else after_try_block
+            later_handlers = exception_handlers[i + 1:]
+            if star and later_handlers:
+                # Joins the end of this handler to the ways on from it
+                next_handler_block = self.new_block()
+                self.add_all_to_exits(next_handler_block,
+                                      later_handlers + [handler_exit])
+                handler_exit = next_handler_block
             self.check_child_exits(self.current_block, handler_exit)
-            exception_handlers.append(initial_handler_block)   
         self.current_line_num = before_line_no         
         
         f_blocks = []
@@ -392,7 +833,7 @@ class ControlFlowGraph(AstFullTraverser):
             self.push_frame_block(f[0], f[1])
         self.use_block(try_body_block)
         for z in node.body:
-            self.visit(z)
+            yield z
         for f in reversed(f_blocks):
             self.pop_frame_block(f[0], f[1])
         
@@ -402,14 +843,95 @@ class ControlFlowGraph(AstFullTraverser):
             self.check_child_exits(self.current_block, orelse_block)
             self.use_block(orelse_block)
             for z in node.orelse:
-                self.visit(z)
+                yield z
             orelse_exit = final_block if node.finalbody else after_try_block
             self.check_child_exits(self.current_block, orelse_exit)
         else:
             self.check_child_exits(self.current_block, after_try_block)
             
         self.use_next_block(after_try_block)     
+
+    do_TryStar = do_Try
         
+class StatementCFG(ControlFlowGraph):
+    ''' A ControlFlowGraph which only dispatches on statements.
+    
+    Expressions are never visited. The only expressions which affect control
+    flow are yields, so a statement's expressions are only scanned for them
+    when one of its lines mentions yield. Without the source every statement
+    is scanned.
+    Unlike ControlFlowGraph, parts of multi-line expressions never end up in
+    a block's statements.
+    '''
+
+    def __init__(self, compress_exceptions=False, simplify=False):
+        ControlFlowGraph.__init__(self, compress_exceptions, simplify)
+        # Sorted numbers of the lines which mention yield. None when unknown
+        self.yield_lines = None
+
+    def source_to_ast(self, source, file_path='<unknown>'):
+        if isinstance(source, bytes):
+            text = source
+        else:
+            text = source.encode('utf-8', 'surrogatepass')
+        self.yield_lines = []
+        if b'yield' in text:
+            self.yield_lines = [i for i, line in
+                                enumerate(text.splitlines(), 1)
+                                if b'yield' in line]
+        return ControlFlowGraph.source_to_ast(self, source, file_path)
+
+    def find_yields(self, node):
+        ''' Return the yields in the statement's own expressions, in the
+            order ControlFlowGraph would visit them. Nested statements are
+            left alone, as are lambdas, whose yields are their own, and the
+            values of yields, which ControlFlowGraph does not visit. '''
+        if self.yield_lines is not None:
+            i = bisect_left(self.yield_lines, node.lineno)
+            if i == len(self.yield_lines) or \
+                    self.yield_lines[i] > node.end_lineno:
+                return ()
+        found = []
+        stack = [node]
+        while stack:
+            expr = stack.pop()
+            if expr.__class__ is ast.Yield or expr.__class__ is ast.YieldFrom:
+                found.append(expr)
+                continue
+            children = [z for z in ast.iter_child_nodes(expr)
+                        if not isinstance(z, ast.stmt)
+                        and z.__class__ is not ast.Lambda]
+            children.reverse()
+            stack.extend(children)
+        return found
+
+    def visit_yields(self, node):
+        for z in self.find_yields(node):
+            self.visit(z)
+
+    def do_statement(self, node):
+        ''' Handler for every statement the graph does not model itself. '''
+        self.visit_yields(node)
+        if hasattr(node, 'body'):
+            return self.nested_statements(node)
+
+    def nested_statements(self, node):
+        for z in node.body:
+            yield z
+
+    def do_ClassDef(self, node):
+        self.visit_yields(node)
+        return self.build_graph(node)
+
+    do_AnnAssign = do_Assert = do_Assign = do_AugAssign = \
+        do_Delete = do_Expr = do_Global = do_Import = do_ImportFrom = \
+        do_Nonlocal = do_Pass = do_Raise = do_With = do_AsyncWith = \
+        do_statement
+
+    def do_Return(self, node):
+        self.visit_yields(node)
+        self.add_return_exit()
+
 class PrintCFG(AstFullTraverser):
     
     def __init__(self, cfg):
@@ -420,26 +942,51 @@ class PrintCFG(AstFullTraverser):
         
     def visit(self, node):
         '''Visit a single node. Callers are responsible for visiting children.'''
-        method = getattr(self, 'do_' + node.__class__.__name__)
-        return method(node)
+        try:
+            method = self.dispatch_table[node.__class__]
+        except KeyError:
+            method = self.find_visitor(node.__class__)
+        return method(self, node)
     
+    def do_Module(self, node):
+        ''' Print every graph built for the module. A module built a function
+            at a time has no index of its graphs, so its tree is walked for
+            them instead, as CompactCFG.from_module does. '''
+        index = getattr(node, 'graphs', None)
+        if index is None:
+            built = [child for child in ast.walk(node)
+                     if getattr(child, 'initial_block', None) is not None]
+            built.sort(key=lambda child: child.lineno)
+            for child in built:
+                self.do_FunctionDef(child)
+            return
+        for qualname, graph_node in index.items():
+            print ("CFG for " + qualname)
+            self.process_blocks(graph_node.initial_block)
+
     def do_FunctionDef(self, node):
         print ("CFG for " + node.name)
         self.process_blocks(node.initial_block)
+
+    do_AsyncFunctionDef = do_FunctionDef
         
     def process_blocks(self, block):
-        ''' TODO: Handle infinite loops '''
-        if block.marked:
-            return
-        if block.start_line_no == "Exit":
-            return
-        exit_nos = [block.start_line_no for block in block.exit_blocks]
-        pprint("Block starting at: " + str(block.start_line_no) + " to " + str(exit_nos))
-        block.marked = True
-        for an_exit in block.exit_blocks:
-            self.process_blocks(an_exit)
-        if block.next_block:
-            self.process_blocks(block.next_block)
+        ''' Print every block reachable from block, depth first with exits
+            before the next block. Uses an explicit stack so long chains of
+            blocks do not recurse. '''
+        stack = [block]
+        while stack:
+            block = stack.pop()
+            if block.marked:
+                continue
+            if block is EXIT_BLOCK:
+                continue
+            exit_nos = [block.start_line_no for block in block.exit_blocks]
+            pprint("Block starting at: " + str(block.start_line_no) + " to " + str(exit_nos))
+            block.marked = True
+            if block.next_block:
+                stack.append(block.next_block)
+            stack.extend(reversed(block.exit_blocks))
         
         
 if __name__ == '__main__':
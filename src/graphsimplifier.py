@@ -0,0 +1,200 @@
+'''
+Shrinks a finished control flow graph without changing where control can go.
+
+Construction leaves behind blocks which carry no statements: after-blocks of
+ifs, loops and trys which were never used, join points with a single way on
+and code which can never run. simplify makes one linear pass over a graph
+which
+
+    drops every block which can not be reached from the initial block
+    skips empty blocks with a single successor, pointing their
+        predecessors at that successor
+    removes repeated exits, as left when both sides of an if now lead to
+        the same block
+    fuses a block with its only successor when it is that block's only
+        predecessor, so each straight line of code is a single block
+
+Loop headers and the Exit block are never skipped or fused away. A block
+whose only way on is its next_block, as the block holding a try statement,
+is given that as an exit, so afterwards every edge is in exit_blocks. Edges
+are counted as CompactCFG.flow_edges counts them. Predecessors are rebuilt
+to match.
+'''
+
+class GraphSimplifier():
+
+    def __init__(self):
+        # Totals over every graph simplified. Useful for profiling
+        self.graphs = 0
+        self.blocks_removed = 0
+        self.edges_removed = 0
+
+    def simplify(self, initial_block):
+        ''' Simplify the graph starting at initial_block in place and return
+            its initial block, which is a different block if the initial
+            block was skipped. '''
+        blocks, edges = self.count(initial_block)
+        # Id -> the block which replaces a skipped or fused block
+        replaced = {}
+        initial_block = self.skip_empty_blocks(initial_block, replaced)
+        order = self.fuse_blocks(initial_block, replaced)
+        self.fix_next_blocks(order, replaced)
+        self.graphs += 1
+        self.blocks_removed += blocks - len(order)
+        self.edges_removed += edges - sum(len(block.exit_blocks)
+                                          for block in order)
+        return initial_block
+
+    def successors(self, block):
+        if block.exit_blocks:
+            return block.exit_blocks
+        if block.next_block is not None:
+            return [block.next_block]
+        return []
+
+    def count(self, initial_block):
+        ''' The number of blocks and flow edges consumers of the graph see,
+            which includes blocks only reached through a next_block. '''
+        seen = set([id(initial_block)])
+        stack = [initial_block]
+        edges = 0
+        while stack:
+            block = stack.pop()
+            exits = block.exit_blocks
+            next_block = block.next_block
+            if exits:
+                edges += len(exits)
+            elif next_block is not None:
+                edges += 1
+            for successor in exits:
+                if id(successor) not in seen:
+                    seen.add(id(successor))
+                    stack.append(successor)
+            if next_block is not None and id(next_block) not in seen:
+                seen.add(id(next_block))
+                stack.append(next_block)
+        return len(seen), edges
+
+    def is_skippable(self, block):
+        if block.statements:
+            return False
+        successors = self.successors(block)
+        # Exits hold no repeats
+        if len(successors) != 1:
+            return False
+        return successors[0] is not block
+
+    def forward(self, block, replaced):
+        ''' The block control reaches from block through skippable blocks.
+            A cycle of empty blocks keeps the block where it closes. '''
+        path = []
+        on_path = set()
+        while id(block) not in replaced and self.is_skippable(block):
+            if id(block) in on_path:
+                break
+            path.append(block)
+            on_path.add(id(block))
+            block = self.successors(block)[0]
+        block = replaced.get(id(block), block)
+        for skipped in path:
+            if skipped is not block:
+                replaced[id(skipped)] = block
+        return block
+
+    def skip_empty_blocks(self, initial_block, replaced):
+        ''' Point every reachable block's exits past skippable blocks,
+            removing repeats. Returns the new initial block. '''
+        initial_block = self.forward(initial_block, replaced)
+        seen = set([id(initial_block)])
+        stack = [initial_block]
+        while stack:
+            block = stack.pop()
+            exits = []
+            targets = set()
+            for successor in self.successors(block):
+                # Most blocks hold statements, so keep their path short
+                if not successor.statements:
+                    successor = self.forward(successor, replaced)
+                if id(successor) not in targets:
+                    targets.add(id(successor))
+                    exits.append(successor)
+                if id(successor) not in seen:
+                    seen.add(id(successor))
+                    stack.append(successor)
+            block.exit_blocks = exits
+        return initial_block
+
+    def fuse_blocks(self, initial_block, replaced):
+        ''' Rebuild the predecessors, then fuse straight lines of blocks.
+            Returns the surviving blocks in depth first preorder. A block
+            with a single predecessor comes after it in that order, so a
+            line is always fused from its first block. '''
+        order = []
+        initial_block.predecessors = []
+        seen = set([id(initial_block)])
+        stack = [initial_block]
+        while stack:
+            block = stack.pop()
+            order.append(block)
+            for successor in reversed(block.exit_blocks):
+                if id(successor) not in seen:
+                    seen.add(id(successor))
+                    # The exit keeps none
+                    if successor.tag != successor.EXIT:
+                        successor.predecessors = []
+                    stack.append(successor)
+                successor.predecessors.append(block)
+        survivors = []
+        for block in order:
+            if id(block) in replaced:
+                continue
+            survivors.append(block)
+            while len(block.exit_blocks) == 1 and block.raises_to is None:
+                successor = block.exit_blocks[0]
+                # The exit and loop headers are tagged
+                if successor is block or successor is initial_block or \
+                        len(successor.predecessors) != 1 or \
+                        successor.tag != block.NORMAL:
+                    break
+                self.fuse(block, successor)
+                replaced[id(successor)] = block
+        # Tuples once fused, as BlockMerger leaves them
+        for block in survivors:
+            if block.tag != block.EXIT:
+                block.predecessors = tuple(block.predecessors)
+        return survivors
+
+    def fuse(self, block, successor):
+        ''' Append successor, whose only predecessor is block, to block. '''
+        block.statements.extend(successor.statements)
+        for e in successor.exit_blocks:
+            predecessors = e.predecessors
+            # The exit keeps none
+            if predecessors:
+                predecessors[predecessors.index(successor)] = block
+        block.exit_blocks = successor.exit_blocks
+        block.has_return = successor.has_return
+        block.raises_to = successor.raises_to
+        if not block.start_line_no:
+            block.start_line_no = successor.start_line_no
+        if successor.next_block is not None or \
+                block.next_block is successor:
+            block.next_block = successor.next_block
+        if successor.next is not None or block.next is successor:
+            block.next = successor.next
+
+    def fix_next_blocks(self, survivors, replaced):
+        ''' Point next_block and next at surviving blocks, or at nothing
+            when the block they named can not be reached. '''
+        alive = set(id(block) for block in survivors)
+        def resolve(block):
+            while block is not None and id(block) in replaced:
+                block = replaced[id(block)]
+            if block is None or id(block) not in alive:
+                return None
+            return block
+        for block in survivors:
+            next_block = resolve(block.next_block)
+            block.next_block = next_block if next_block is not block \
+                else None
+            block.next = resolve(block.next)
@@ -0,0 +1,99 @@
+'''
+Rebuilds only the functions of a file which have changed since the last run.
+
+Each function which is not nested in another function is fingerprinted by a
+hash of its source lines. On the next parse any function with a fingerprint
+seen in the previous run gets the previous FunctionDef, with its graph,
+swapped into the new tree instead of being built again. If the function has
+moved its line numbers are shifted to match.
+'''
+
+from src.controlflowgraph import ControlFlowGraph, StatementCFG, EXIT_BLOCK
+from src.compactgraph import number_blocks
+import hashlib
+import ast
+import re
+
+# The line endings ast counts lines by. str.splitlines also splits on form
+# feeds and other separators, which would put the wrong lines in a fingerprint
+LINE_END = re.compile(r'\r\n|\r|\n')
+
+class IncrementalCFG():
+
+    def __init__(self, statements_only=False, compress_exceptions=False,
+                 simplify=False):
+        cfg_class = StatementCFG if statements_only else ControlFlowGraph
+        self.cfg = cfg_class(compress_exceptions, simplify)
+        # Fingerprint -> FunctionDefs from the previous run with that source
+        self.previous = {}
+        # Counts for the last parse
+        self.rebuilt = 0
+        self.reused = 0
+
+    def parse_file(self, file_path):
+        source = self.cfg.get_source(file_path)
+        return self.parse_source(source, file_path)
+
+    def parse_source(self, source, file_path='<unknown>'):
+        ''' Return the module's ast with a graph attached to every function.
+            Module level code is not given a graph. '''
+        source_ast = self.cfg.source_to_ast(source, file_path)
+        lines = LINE_END.split(source)
+        current = {}
+        self.rebuilt = 0
+        self.reused = 0
+        for statements, i in self.find_functions(source_ast):
+            node = statements[i]
+            key = self.fingerprint(lines, node)
+            candidates = self.previous.get(key)
+            if candidates:
+                old_node = candidates.pop()
+                self.move_function(old_node, node.lineno - old_node.lineno)
+                statements[i] = old_node
+                node = old_node
+                self.reused += 1
+            else:
+                self.cfg.build_function(node)
+                self.rebuilt += 1
+            current.setdefault(key, []).append(node)
+        self.previous = current
+        return source_ast
+
+    def find_functions(self, node):
+        ''' Yield (statement list, index) for every function which is not
+            nested in another function. '''
+        for field, value in ast.iter_fields(node):
+            if not isinstance(value, list):
+                continue
+            for i, child in enumerate(value):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    yield value, i
+                elif isinstance(child, (ast.stmt, ast.excepthandler,
+                                        ast.match_case)):
+                    for found in self.find_functions(child):
+                        yield found
+
+    def fingerprint(self, lines, node):
+        ''' The whole lines are hashed so a change in indentation is seen.
+            Decorators are part of the function swapped in, so their lines
+            are too. '''
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        text = '\n'.join(lines[start - 1:node.end_lineno])
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def move_function(self, node, delta):
+        ''' Shift a reused function, its statements and its blocks by delta
+            lines. '''
+        if not delta:
+            return
+        ast.increment_lineno(node, delta)
+        # Graphs of nested functions are shifted too
+        blocks = {}
+        for child in ast.walk(node):
+            initial_block = getattr(child, 'initial_block', None)
+            if initial_block is not None:
+                for block in number_blocks(initial_block)[0]:
+                    blocks[id(block)] = block
+        for block in blocks.values():
+            if block is not EXIT_BLOCK and block.start_line_no:
+                block.start_line_no += delta
@@ -0,0 +1,133 @@
+'''
+Builds a function's graph only when it is asked for.
+
+parse_file and parse_source only parse the file and index its functions by
+qualified name, as __qualname__ would give it (Class.method,
+outer.<locals>.inner). Looking a function up builds the graph of the
+outermost function holding it, which also gives graphs to every function
+nested in that one, and returns the function's initial block.
+
+Built functions are kept in a least recently used cache of max_functions
+outermost functions. An evicted function loses its graph and is built again
+if it is asked for again.
+'''
+
+from src.controlflowgraph import ControlFlowGraph, StatementCFG
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+import ast
+
+# node is the FunctionDef. outermost is the FunctionDef which is built to
+# give it a graph, which is node itself unless it is nested in a function
+FunctionInfo = namedtuple('FunctionInfo', ['name', 'qualname', 'lineno',
+                                           'end_lineno', 'node',
+                                           'outermost'])
+
+# Functions the builder can give a graph
+FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+class LazyCFG(Mapping):
+    ''' A mapping from the qualified name of every function in a file to its
+    initial block.
+
+    A name defined more than once keeps its first definition under the plain
+    qualified name. Later ones are keyed qualname@lineno.
+    '''
+
+    def __init__(self, statements_only=False, compress_exceptions=False,
+                 simplify=False, max_functions=128):
+        cfg_class = StatementCFG if statements_only else ControlFlowGraph
+        self.cfg = cfg_class(compress_exceptions, simplify)
+        self.max_functions = max_functions
+        self.functions = OrderedDict()
+        self.source_ast = None
+        # Outermost FunctionDefs with graphs, least recently used first
+        self.built = OrderedDict()
+        # Counts since the last parse
+        self.builds = 0
+        self.evictions = 0
+
+    def parse_file(self, file_path):
+        source = self.cfg.get_source(file_path)
+        return self.parse_source(source, file_path)
+
+    def parse_source(self, source, file_path='<unknown>'):
+        ''' Index the functions of source, dropping any previous file. '''
+        self.source_ast = self.cfg.source_to_ast(source, file_path)
+        self.functions = OrderedDict()
+        self.built = OrderedDict()
+        self.builds = 0
+        self.evictions = 0
+        self.index_functions(self.source_ast)
+        return self
+
+    def index_functions(self, tree):
+        ''' Only statements are walked, as functions can not be defined
+            anywhere else. '''
+        # Entries are a statement, the prefix of the names defined in the
+        # statement it is in and the outermost function holding it
+        stack = [(child, '', None) for child in reversed(tree.body)]
+        while stack:
+            node, prefix, outermost = stack.pop()
+            if isinstance(node, FUNCTION_TYPES):
+                qualname = prefix + node.name
+                outermost = outermost or node
+                self.add_function(node, qualname, outermost)
+                prefix = qualname + '.<locals>.'
+            elif isinstance(node, ast.ClassDef):
+                prefix = prefix + node.name + '.'
+            children = []
+            for field in ('body', 'orelse', 'finalbody', 'handlers', 'cases'):
+                children.extend(getattr(node, field, ()))
+            for child in reversed(children):
+                stack.append((child, prefix, outermost))
+
+    def add_function(self, node, qualname, outermost):
+        key = qualname
+        if key in self.functions:
+            key = '%s@%d' % (qualname, node.lineno)
+        self.functions[key] = FunctionInfo(node.name, qualname, node.lineno,
+                                           node.end_lineno, node, outermost)
+
+    def __getitem__(self, key):
+        ''' The initial block of the function, building it if need be. '''
+        info = self.functions[key]
+        outermost = info.outermost
+        if outermost in self.built:
+            self.built.move_to_end(outermost)
+        else:
+            self.build(outermost)
+        return info.node.initial_block
+
+    def __iter__(self):
+        return iter(self.functions)
+
+    def __len__(self):
+        return len(self.functions)
+
+    def __contains__(self, key):
+        ''' Mapping's would look the function up, building it. '''
+        return key in self.functions
+
+    def is_built(self, key):
+        return self.functions[key].outermost in self.built
+
+    def function_node(self, key):
+        ''' The FunctionDef, with its graph built. '''
+        self[key]
+        return self.functions[key].node
+
+    def build(self, node):
+        self.cfg.build_function(node)
+        self.builds += 1
+        self.built[node] = True
+        while len(self.built) > self.max_functions:
+            old_node = self.built.popitem(last=False)[0]
+            self.drop_graphs(old_node)
+            self.evictions += 1
+
+    def drop_graphs(self, node):
+        ''' Remove the graphs of node and the functions nested in it. '''
+        for child in ast.walk(node):
+            if getattr(child, 'initial_block', None) is not None:
+                del child.initial_block
@@ -1,9 +1,29 @@
+import ast
+
 class AstBaseTraverser:
     '''The base class for all other traversers.'''
 
+    # Node class -> do_ function of this traverser class. Every subclass gets
+    # its own table, filled in the first time it meets each node class, so
+    # visitors are found by a single dict lookup instead of getattr.
+    # Note: do_ methods added to a class after it has visited are not seen.
+    dispatch_table = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch_table = {}
+
     def __init__(self):
         pass
         # A unit test now calls self.check_visitor_names().
+
+    def find_visitor(self, node_class):
+        '''Return the do_ method for node_class, remembering it for the
+        traverser's class.'''
+        assert issubclass(node_class,ast.AST),node_class.__name__
+        method = getattr(self.__class__,'do_' + node_class.__name__)
+        self.__class__.dispatch_table[node_class] = method
+        return method
     
     def attribute_base(self,node):
         
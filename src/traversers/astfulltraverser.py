@@ -30,6 +30,9 @@ class AstFullTraverser(AstBaseTraverser):
 
     def do_Bytes(self,node): 
         pass # Python 3.x only.
+
+    def do_Constant(self,node):
+        pass # Python 3.8+: replaces Num, Str, Bytes and NameConstant.
         
     def do_Ellipsis(self,node):
         pass
@@ -97,10 +100,18 @@ class AstFullTraverser(AstBaseTraverser):
 
     def do_Dict(self,node):
         for z in node.keys:
-            self.visit(z)
+            # A None key is a ** unpacking.
+            if z:
+                self.visit(z)
         for z in node.values:
             self.visit(z)
 
+    def do_DictComp(self,node):
+        self.visit(node.key)
+        self.visit(node.value)
+        for z in node.generators:
+            self.visit(z)
+
     def do_Expr(self,node):   
         self.visit(node.value)
 
@@ -125,6 +136,15 @@ class AstFullTraverser(AstBaseTraverser):
     def do_Index (self,node):  
         self.visit(node.value)
 
+    def do_JoinedStr(self,node):
+        for z in node.values:
+            self.visit(z)
+
+    def do_FormattedValue(self,node):
+        self.visit(node.value)
+        if node.format_spec:
+            self.visit(node.format_spec)
+
     def do_keyword(self,node):
         self.visit(node.value)
 
@@ -143,11 +163,20 @@ class AstFullTraverser(AstBaseTraverser):
         # self.visit(node.ctx)
         pass
 
+    def do_NamedExpr(self,node):
+        self.visit(node.target)
+        self.visit(node.value)
+
     # Python 2.x only
     # Repr(expr value)
     def do_Repr(self,node):
         self.visit(node.value)
 
+    def do_SetComp(self,node):
+        self.visit(node.elt)
+        for z in node.generators:
+            self.visit(z)
+
     def do_Slice (self,node):
         if getattr(node,'lower',None):
             self.visit(node.lower)
@@ -156,6 +185,10 @@ class AstFullTraverser(AstBaseTraverser):
         if getattr(node,'step',None):
             self.visit(node.step)
 
+    def do_Starred(self,node):
+        self.visit(node.value)
+        # self.visit(node.ctx)
+
     def do_Subscript(self,node):
         self.visit(node.value)
         self.visit(node.slice)
@@ -181,6 +214,12 @@ class AstFullTraverser(AstBaseTraverser):
         if node.msg:
             self.visit(node.msg)
 
+    def do_AnnAssign(self,node):
+        self.visit(node.target)
+        self.visit(node.annotation)
+        if node.value:
+            self.visit(node.value)
+
     def do_Assign(self,node):
         for z in node.targets:
             self.visit(z)
@@ -231,6 +270,8 @@ class AstFullTraverser(AstBaseTraverser):
         for z in node.orelse:
             self.visit(z)
 
+    do_AsyncFor = do_For
+
     def do_FunctionDef (self,node):
         self.visit(node.args)
         for z in node.body:
@@ -238,9 +279,15 @@ class AstFullTraverser(AstBaseTraverser):
         for z in node.decorator_list:
             self.visit(z)
 
+    # Python 3.5+
+    do_AsyncFunctionDef = do_FunctionDef
+
     def do_Global(self,node):
         pass
 
+    def do_Nonlocal(self,node):
+        pass
+
     def do_If(self,node):
         self.visit(node.test)
         for z in node.body:
@@ -276,6 +323,11 @@ class AstFullTraverser(AstBaseTraverser):
             self.visit(expr)
 
     def do_Raise(self,node):
+        # Python 3: Raise(expr? exc, expr? cause)
+        if getattr(node,'exc',None):
+            self.visit(node.exc)
+        if getattr(node,'cause',None):
+            self.visit(node.cause)
         if getattr(node,'type',None):
             self.visit(node.type)
         if getattr(node,'inst',None):
@@ -297,6 +349,9 @@ class AstFullTraverser(AstBaseTraverser):
         for z in node.finalbody:
             self.visit(z)
 
+    # Python 3.11+: try/except*
+    do_TryStar = do_Try
+
     def do_TryExcept(self,node):
         for z in node.body:
             self.visit(z)
@@ -319,19 +374,78 @@ class AstFullTraverser(AstBaseTraverser):
             self.visit(z)
             
     def do_With (self,node):
-        self.visit(node.context_expr)
-        if node.optional_vars:
-            self.visit(node.optional_vars)
+        # Python 3.3+: With(withitem* items, stmt* body)
+        for item in getattr(node,'items',[node]):
+            self.visit(item.context_expr)
+            if item.optional_vars:
+                self.visit(item.optional_vars)
         for z in node.body:
             self.visit(z)
 
+    do_AsyncWith = do_With
+
+    # Python 3.10+: match statements and their patterns
+
+    def do_Match(self,node):
+        self.visit(node.subject)
+        for z in node.cases:
+            self.visit(z)
+
+    def do_match_case(self,node):
+        self.visit(node.pattern)
+        if node.guard:
+            self.visit(node.guard)
+        for z in node.body:
+            self.visit(z)
+
+    def do_MatchValue(self,node):
+        self.visit(node.value)
+
+    def do_MatchSingleton(self,node):
+        pass
+
+    def do_MatchSequence(self,node):
+        for z in node.patterns:
+            self.visit(z)
+
+    def do_MatchMapping(self,node):
+        for z in node.keys:
+            self.visit(z)
+        for z in node.patterns:
+            self.visit(z)
+
+    def do_MatchClass(self,node):
+        self.visit(node.cls)
+        for z in node.patterns:
+            self.visit(z)
+        for z in node.kwd_patterns:
+            self.visit(z)
+
+    def do_MatchStar(self,node):
+        pass
+
+    def do_MatchAs(self,node):
+        if node.pattern:
+            self.visit(node.pattern)
+
+    def do_MatchOr(self,node):
+        for z in node.patterns:
+            self.visit(z)
+
     def do_Yield(self,node):
         if node.value:
             self.visit(node.value)
 
+    def do_YieldFrom(self,node):
+        self.visit(node.value)
+
+    def do_Await(self,node):
+        self.visit(node.value)
+
     def visit(self,node):
         '''Visit a *single* ast node.  Visitors are responsible for visiting children!'''
-        assert isinstance(node,ast.AST),node.__class__.__name__
-        method_name = 'do_' + node.__class__.__name__
-        method = getattr(self,method_name)
-        return method(node)
\ No newline at end of file
+        try:
+            method = self.dispatch_table[node.__class__]
+        except KeyError:
+            method = self.find_visitor(node.__class__)
+        return method(self,node)
\ No newline at end of file